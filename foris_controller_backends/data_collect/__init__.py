@@ -17,94 +17,814 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 #
 
+import atexit
+import json
+import os
 import re
 import logging
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
 
 from foris_controller.app import app_info
-from foris_controller.exceptions import BackendCommandFailed
-from foris_controller_backends.cmdline import BaseCmdLine
-from foris_controller_backends.files import BaseFile
-from foris_controller_backends.services import OpenwrtServices
-from foris_controller_backends.uci import (
-    UciBackend, UciRecordNotFound, parse_bool, get_option_named, store_bool
-)
-from foris_controller.utils import readlock, RWLock
+from foris_controller_backends.files import BaseFile, inject_file_root
+from foris_controller.utils import RWLock
+
+from .atomic import write_atomically
+from .metrics import metrics
 
 
 logger = logging.getLogger(__name__)
 
 
-class RegisteredCmds(BaseCmdLine):
+def _env_number(name, default, convert=float):
+    """ Reads a numeric setting from the environment
+
+    :param name: name of the environment variable
+    :type name: str
+    :param default: value used when the variable is not set or is malformed
+    :param convert: function which converts the string value
+    :returns: the setting value
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        logger.warning("Malformed value '%s' of '%s'. Using '%s'." % (value, name, default))
+        return default
+
+
+def _cmdline_path(path):
+    """ Prefixes the path of a command with FORIS_CMDLINE_ROOT (used in tests) """
+    root = os.environ.get("FORIS_CMDLINE_ROOT")
+    return os.path.join(root, path.lstrip("/")) if root else path
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RegistrationCache(object):
+    """ LRU cache of registration queries
+
+    Final answers (owned, free, foreign) are kept for `final_ttl` seconds,
+    transient ones (unknown, not_found) only for `transient_ttl` seconds.
+    Zero ttl means that such answers are not cached at all.
+
+    Expired answers are kept for another `stale_ttl` seconds so that they can be
+    served while being refreshed.
+
+    When `persist_path` is set, the entries are stored there after each change
+    (atomically, in a versioned JSON format) and they are loaded on the first use,
+    so a restarted controller starts with a warm cache.
+    """
+    FINAL_STATUSES = {"owned", "free", "foreign"}
+    VERSION = 1
+
+    def __init__(self, final_ttl, transient_ttl, max_entries, stale_ttl=0, persist_path=None):
+        self.final_ttl = final_ttl
+        self.transient_ttl = transient_ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._loaded = not persist_path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _ttl(self, result):
+        if result["status"] in RegistrationCache.FINAL_STATUSES:
+            return self.final_ttl
+        return self.transient_ttl
+
+    def _load(self):
+        """ Loads persisted entries (has to be called with the lock held) """
+        self._loaded = True
+        try:
+            with open(self.persist_path) as f:
+                data = json.load(f)
+            if data.get("version") != RegistrationCache.VERSION:
+                raise ValueError("unsupported version %r" % data.get("version"))
+            now = time.time()
+            entries = []
+            for entry in data["entries"]:
+                key = tuple(entry["key"])
+                result = entry["result"]
+                if len(key) != 3 or not isinstance(result, dict) or "status" not in result:
+                    raise ValueError("malformed entry")
+                # don't trust expiration times longer than the current ttl
+                expires_at = min(float(entry["expires_at"]), now + self._ttl(result))
+                if expires_at + self.stale_ttl > now:
+                    entries.append((key, result, expires_at))
+        except FileNotFoundError:
+            return
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(
+                "Ignoring registration cache file '%s' (%s)." % (self.persist_path, e)
+            )
+            return
+
+        for key, result, expires_at in entries:
+            self._entries.setdefault(key, (result, expires_at))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        if not self.persist_path:
+            return
+        with self._write_lock:
+            with self._lock:
+                data = {
+                    "version": RegistrationCache.VERSION,
+                    "entries": [
+                        {"key": list(key), "result": result, "expires_at": expires_at}
+                        for key, (result, expires_at) in self._entries.items()
+                    ],
+                }
+            try:
+                # contains emails => readable by the owner only
+                write_atomically(self.persist_path, json.dumps(data).encode(), 0o600)
+            except (IOError, OSError) as e:
+                logger.warning(
+                    "Failed to store registration cache to '%s' (%s)." % (self.persist_path, e)
+                )
+
+    def lookup(self, key):
+        """ Returns a cached result and whether it is still fresh
+
+        :param key: (email, language, registration_code)
+        :type key: tuple
+        :returns: (copy of the cached result, fresh) or (None, False) if missing
+        :rtype: tuple
+        """
+        now = time.time()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            try:
+                result, expires_at = self._entries[key]
+            except KeyError:
+                return None, False
+            if expires_at + self.stale_ttl <= now:
+                del self._entries[key]
+                return None, False
+            self._entries.move_to_end(key)
+            return dict(result), expires_at > now
+
+    def get(self, key):
+        """ Returns a cached result
+
+        :param key: (email, language, registration_code)
+        :type key: tuple
+        :returns: copy of the cached result or None if missing or expired
+        :rtype: dict or None
+        """
+        result, fresh = self.lookup(key)
+        return result if fresh else None
+
+    def put(self, key, result):
+        """ Stores a result, the least recently used entries are evicted
+
+        :param key: (email, language, registration_code)
+        :type key: tuple
+        :param result: result of the registration query
+        :type result: dict
+        """
+        ttl = self._ttl(result)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[key] = (dict(result), time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._save()
+
+    def clear(self):
+        with self._lock:
+            self._loaded = True
+            self._entries.clear()
+        self._save()
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls with the same key
+
+    Only the first caller runs the function, the others wait for it to finish
+    and obtain the same result (or exception).
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, timeout, func, *args, **kwargs):
+        """ Runs the function or waits for the result of the running one
+
+        :param key: calls with the same key are coalesced
+        :param timeout: how long to wait for a running call (None = no limit)
+        :type timeout: float
+        :param func: function which is called with args and kwargs
+        :returns: result of the function
+        :raises DeadlineExceeded: when the running call didn't finish in time
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = SingleFlight._Call()
+                self._calls[key] = call
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class CircuitBreaker(object):
+    """ Stops calling an unreachable server for a while
+
+    closed    - calls are allowed, consecutive failures are counted
+    open      - calls are rejected until the cool-down passes
+    half_open - a single probe call is allowed, its result closes or reopens the breaker
+
+    Threshold <= 0 disables the breaker.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold, cooldown):
+        """
+        :param threshold: number of consecutive failures which opens the breaker
+        :type threshold: int
+        :param cooldown: how long the breaker stays open (seconds)
+        :type cooldown: float
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._opened = None  # (time.time(), time.monotonic())
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ Checks whether a call may proceed (the caller has to report its outcome)
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN:
+                if time.monotonic() - self._opened[1] < self.cooldown:
+                    return False
+                self.state = CircuitBreaker.HALF_OPEN
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            if self.state != CircuitBreaker.CLOSED:
+                logger.info("Registration server is reachable again.")
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self._opened = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == CircuitBreaker.HALF_OPEN or (
+                self.threshold > 0 and self.failures >= self.threshold
+            ):
+                if self.state != CircuitBreaker.OPEN:
+                    logger.warning(
+                        "Registration server unreachable (%d failures), pausing queries for %ss."
+                        % (self.failures, self.cooldown)
+                    )
+                self.state = CircuitBreaker.OPEN
+                self._opened = (time.time(), time.monotonic())
+
+    def release(self):
+        """ Reports a call which didn't tell anything about the server """
+        with self._lock:
+            self._probing = False
+
+    def status(self):
+        """ Returns the current state
+
+        :returns: {"state": ..., "failures": ..., "opened_at": ..., "retry_in": ...}
+        :rtype: dict
+        """
+        with self._lock:
+            if self._opened is None:
+                opened_at, retry_in = None, None
+            else:
+                opened_at = self._opened[0]
+                retry_in = max(0.0, self.cooldown - (time.monotonic() - self._opened[1]))
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened_at": opened_at,
+                "retry_in": round(retry_in, 3) if retry_in is not None else None,
+            }
+
+
+class RegistrationCodeFile(BaseFile):
+    """ Memoized reading of the registration code
+
+    The file is read again only when its mtime, inode or size changes.
+    """
+    PATH = "/usr/share/server-uplink/registration_code"
+
+    def __init__(self):
+        self._stamp = None
+        self._code = None
+        self._lock = threading.Lock()
+
+    def get_registration_code(self):
+        """ Returns the registration code
+
+        :returns: registration code or None when it is not available
+        :rtype: str or None
+        """
+        try:
+            stat = os.stat(inject_file_root(RegistrationCodeFile.PATH))
+        except OSError:
+            self.invalidate()
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        with self._lock:
+            if stamp == self._stamp:
+                return self._code
+
+        try:
+            code = self._file_content(RegistrationCodeFile.PATH).strip() or None
+        except IOError:
+            self.invalidate()
+            return None
+
+        with self._lock:
+            self._stamp = stamp
+            self._code = code
+        return code
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
+            self._code = None
 
-    def _query_registered(self, email, language):
+
+class RegisteredCmds(object):
+    FINAL_TTL = 300.0
+    TRANSIENT_TTL = 10.0
+    STALE_TTL = 24 * 60 * 60.0
+    CACHE_SIZE = 32
+    TIMEOUT = 30.0
+    BREAKER_THRESHOLD = 3
+    BREAKER_COOLDOWN = 60.0
+    CACHE_PATH = "/tmp/foris-data_collect-registration.json"  # tmpfs
+
+    def __init__(self):
+        self.cache = RegistrationCache(
+            _env_number("FORIS_DATA_COLLECT_REGISTERED_TTL", RegisteredCmds.FINAL_TTL),
+            _env_number(
+                "FORIS_DATA_COLLECT_REGISTERED_TRANSIENT_TTL", RegisteredCmds.TRANSIENT_TTL
+            ),
+            _env_number("FORIS_DATA_COLLECT_REGISTERED_CACHE_SIZE", RegisteredCmds.CACHE_SIZE, int),
+            _env_number("FORIS_DATA_COLLECT_REGISTERED_STALE_TTL", RegisteredCmds.STALE_TTL),
+            # empty value disables the persistence
+            os.environ.get("FORIS_DATA_COLLECT_REGISTERED_CACHE_PATH", RegisteredCmds.CACHE_PATH)
+            or None,
+        )
+        self.timeout = _env_number("FORIS_DATA_COLLECT_REGISTERED_TIMEOUT", RegisteredCmds.TIMEOUT)
+        self.breaker = CircuitBreaker(
+            _env_number(
+                "FORIS_DATA_COLLECT_BREAKER_THRESHOLD", RegisteredCmds.BREAKER_THRESHOLD, int
+            ),
+            _env_number("FORIS_DATA_COLLECT_BREAKER_COOLDOWN", RegisteredCmds.BREAKER_COOLDOWN),
+        )
+        self.inflight = SingleFlight()
+        self.registration_code_file = RegistrationCodeFile()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+        # optional in-process client (registered.sh is used when not set or on failure)
+        url = os.environ.get("FORIS_DATA_COLLECT_REGISTRATION_URL")
+        self.http_client = None
+        if url:
+            from .registration_client import RegistrationHttpClient
+            try:
+                self.http_client = RegistrationHttpClient(
+                    url, _env_number("FORIS_DATA_COLLECT_REGISTRATION_HTTP_TIMEOUT", 10.0)
+                )
+            except ValueError as e:
+                logger.warning("Registration URL is ignored (%s)." % e)
+
+    def _get_registration_code(self):
+        return self.registration_code_file.get_registration_code()
+
+    def _run_until(self, deadline, *args):
+        """ Runs a command which is killed (with its children) when the deadline passes
+
+        :param deadline: time.monotonic() based deadline
+        :type deadline: float
+        :returns: (retcode, stdout, stderr)
+        :rtype: tuple
+        :raises DeadlineExceeded: when the command didn't finish in time
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+
+        try:
+            process = subprocess.Popen(
+                (_cmdline_path(args[0]), ) + args[1:],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+            )
+        except OSError as e:
+            logger.warning("Failed to run '%s' (%s)." % (args[0], e))
+            return 127, b"", str(e).encode()
+        try:
+            stdout, stderr = process.communicate(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            logger.warning("'%s' didn't finish in time, killing it." % args[0])
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.communicate()
+            raise DeadlineExceeded()
+        return process.returncode, stdout, stderr
+
+    def _query_registered(self, email, language, deadline):
         # get registration code
-        from foris_controller_backends.about import ServerUplinkFiles
-        registration_code = ServerUplinkFiles().get_registration_number()
+        registration_code = self._get_registration_code()
         if not registration_code:
             # failed to obtain registration code
             return {"status": "unknown"}
-        retcode, stdout, _ = self._run_command(
-            "/usr/share/server-uplink/registered.sh",
-            email, language
-        )
+
+        if self.http_client:
+            from .registration_client import RegistrationQueryFailed
+
+            with metrics.timer("subprocesses", "registered.http") as timer:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded()
+                try:
+                    http_code, body = self.http_client.query(
+                        registration_code, email, language, remaining
+                    )
+                except RegistrationQueryFailed as e:
+                    timer.error = True
+                    logger.warning(
+                        "Registration server query failed (%s), using registered.sh." % e
+                    )
+                else:
+                    return self._parse_registered(http_code, body, registration_code)
+
+        with metrics.timer("subprocesses", "registered.sh") as timer:
+            retcode, stdout, _ = self._run_until(
+                deadline, "/usr/share/server-uplink/registered.sh", email, language
+            )
+            timer.error = retcode != 0
         stdout = stdout.decode()
         if not retcode == 0:
             # cmd failed (e.g. connection failed)
-            return {"status": "unknown"}
+            return {"status": "unknown", "reason": "unreachable"}
 
         # code field should be present
         code_re = re.search(r"code: ([0-9]+)", stdout)
-        http_code = int(code_re.group(1))
+        return self._parse_registered(int(code_re.group(1)), stdout, registration_code)
+
+    def _parse_registered(self, http_code, output, registration_code):
         if http_code != 200:
             return {"status": "not_found"}
 
         # status should be present
-        status_re = re.search(r"status: (\w+)", stdout)
-        status = status_re.group(1)
+        status_re = re.search(r"status: (\w+)", output)
+        status = status_re.group(1) if status_re else None
 
         if status == "owned":
             return {"status": status}
         elif status in ["free", "foreign"]:
-            url_re = re.search(r"url: ([^\s]+)", stdout)
-            url = url_re.group(1)
+            url_re = re.search(r"url: ([^\s]+)", output)
+            if not url_re:
+                return {"status": "unknown"}
             return {
-                "status": status, "url": url,
+                "status": status, "url": url_re.group(1),
                 "registration_number": registration_code,
             }
 
         return {"status": "unknown"}
 
-    def get_registered(self, email, language):
+    def get_registered(self, email, language, on_change=None, timeout=None):
         """ Returns registration status
+
+        An expired cached status is returned immediately (marked as stale)
+        and it is refreshed in the background.
+
+        When the status can't be obtained within `timeout` the scripts are killed
+        and {"status": "unknown", "reason": "timeout"} is returned.
+
         :param email: email which will be used in the server query
         :type email: str
         :param language: language which will be used in the server query (en/cs)
         :type language: str
+        :param on_change: called with the new status when a background refresh changes it
+        :type on_change: callable
+        :param timeout: max time to obtain the status in seconds (module default if None,
+                        longer ones are shortened to the module default)
+        :type timeout: float
 
         :returns: registration status and sometimes registration url
         :rtype: dict
         """
-        res = self._query_registered(email, language)
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        deadline = time.monotonic() + timeout
+        key = (email, language, self._get_registration_code())
+        res, fresh = self.cache.lookup(key)
+        if res is not None:
+            if not fresh:
+                self._refresh(key, email, language, res, on_change)
+                res["stale"] = True
+            return res
+
+        # concurrent identical queries share a single run of the scripts
+        while True:
+            try:
+                res = self.inflight.do(
+                    key, deadline - time.monotonic(), self._fetch_registered,
+                    key, email, language, deadline,
+                )
+            except DeadlineExceeded:
+                return {"status": "unknown", "reason": "timeout"}
+            if res.get("reason") != "timeout" or time.monotonic() >= deadline:
+                return dict(res)
+            # joined a query with a shorter deadline, try again with ours
+
+    def _refresh(self, key, email, language, old, on_change):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
 
-        if res["status"] == "not_found":
-            # Try to update registration code first
+        def worker():
             try:
-                self._run_command_and_check_retval(
-                    ["/usr/share/server-uplink/registration_code.sh"], 0)
-            except BackendCommandFailed:
-                return {"status": "not_found"}
-            res = self._query_registered(email, language)
+                deadline = time.monotonic() + self.timeout
+                new = self.inflight.do(
+                    key, None, self._fetch_registered, key, email, language, deadline, True
+                )
+                if new["status"] == "unknown":
+                    logger.debug("Registration status refresh failed %s." % new)
+                elif on_change and new["status"] != old["status"]:
+                    on_change(dict(new))
+            except Exception:
+                logger.exception("Failed to refresh registration status.")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=worker, name="data_collect-registered-refresh")
+        thread.daemon = True
+        thread.start()
+
+    def _fetch_registered(self, key, email, language, deadline, refresh=False):
+        res = self._get_registered(email, language, deadline)
+        if refresh and res["status"] == "unknown":
+            # server didn't answer, keep the last known status (it is refreshed again later)
+            return res
+        if res.get("reason") not in ("timeout", "circuit_open"):
+            # these depend on the request / breaker state, don't cache them
+            self.cache.put(key, res)
+        return res
+
+    def get_server_status(self):
+        """ Returns the state of the registration server circuit breaker
+
+        :returns: {"state": "closed"/"open"/"half_open", "failures": ..., "opened_at": ...,
+                   "retry_in": ...}
+        :rtype: dict
+        """
+        return self.breaker.status()
+
+    def _get_registered(self, email, language, deadline):
+        if not self.breaker.allow():
+            return {"status": "unknown", "reason": "circuit_open"}
+
+        try:
+            res = self._get_registered_unguarded(email, language, deadline)
+        except Exception:
+            self.breaker.failure()
+            raise
+        if res.get("reason") in ("timeout", "unreachable"):
+            self.breaker.failure()
+        elif res == {"status": "unknown"}:
+            # e.g. missing registration code (server was not contacted)
+            self.breaker.release()
+        else:
+            self.breaker.success()
+        return res
+
+    def _get_registered_unguarded(self, email, language, deadline):
+        try:
+            res = self._query_registered(email, language, deadline)
+
+            if res["status"] == "not_found":
+                # Try to update registration code first
+                try:
+                    with metrics.timer("subprocesses", "registration_code.sh") as timer:
+                        retcode, _, _ = self._run_until(
+                            deadline, "/usr/share/server-uplink/registration_code.sh"
+                        )
+                        timer.error = retcode != 0
+                finally:
+                    # the script may have rewritten the code
+                    self.registration_code_file.invalidate()
+                if retcode != 0:
+                    return {"status": "not_found"}
+                res = self._query_registered(email, language, deadline)
+
+        except DeadlineExceeded:
+            return {"status": "unknown", "reason": "timeout"}
 
         return res
 
 
+class UciSnapshots(object):
+    """ Process-wide cache of parsed uci configs
+
+    A snapshot is reused while the config file keeps its mtime, size and inode.
+    Returned data are shared and must not be modified.
+    """
+    CONFIG_DIR = "/etc/config"
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, config):
+        config_dir = os.environ.get("FORIS_UCI_CONFIG_DIR", UciSnapshots.CONFIG_DIR)
+        try:
+            stat = os.stat(os.path.join(config_dir, config))
+        except OSError:
+            # can't detect changes => don't cache
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def read(self, config):
+        """ Returns parsed uci config
+
+        :param config: config name (e.g. "foris")
+        :type config: str
+        :returns: data as returned by UciBackend.read()
+        """
+        stamp = self._stamp(config)
+        with self._lock:
+            snapshot = self._snapshots.get(config)
+            if stamp and snapshot and snapshot[0] == stamp:
+                return snapshot[1]
+
+        from foris_controller_backends.uci import UciBackend
+
+        with UciBackend() as backend:
+            data = backend.read(config)
+
+        if stamp:
+            with self._lock:
+                self._snapshots[config] = (stamp, data)
+        return data
+
+    def invalidate(self, config):
+        """ Drops the snapshot (should be called after the config is updated)
+
+        :param config: config name (e.g. "foris")
+        :type config: str
+        """
+        with self._lock:
+            self._snapshots.pop(config, None)
+
+
+uci_snapshots = UciSnapshots()
+
+
+class ServiceScheduler(object):
+    """ Coalesces service restarts
+
+    Restarts requested within `delay` seconds since the first one are merged
+    into a single one. Stops are performed immediately (so they are not lost
+    when the controller exits) and they cancel pending restarts of the service.
+    Zero delay means that all the actions are performed immediately.
+    Pending restarts of the module-wide scheduler are flushed at exit.
+    """
+    DELAY = 2.0
+
+    def __init__(self, delay=None):
+        self.delay = delay if delay is not None else _env_number(
+            "FORIS_DATA_COLLECT_RESTART_DELAY", ServiceScheduler.DELAY
+        )
+        self._pending = OrderedDict()
+        self._timer = None
+        self._lock = threading.Lock()
+        # keeps the order of the performed actions
+        self._run_lock = threading.Lock()
+
+    def schedule(self, service, action):
+        """ Requests a service action
+
+        :param service: service name
+        :type service: str
+        :param action: "restart" or "stop"
+        :type action: str
+        """
+        if self.delay <= 0 or action == "stop":
+            with self._run_lock:
+                with self._lock:
+                    self._pending.pop(service, None)
+                self._run(service, action)
+            return
+
+        with self._lock:
+            self._pending[service] = action
+            self._pending.move_to_end(service)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """ Performs pending actions right away """
+        with self._run_lock:
+            with self._lock:
+                pending = list(self._pending.items())
+                self._pending.clear()
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+
+            for service, action in pending:
+                try:
+                    self._run(service, action)
+                except Exception:
+                    logger.exception("Failed to %s service '%s'." % (action, service))
+
+    def _run(self, service, action):
+        from foris_controller_backends.services import OpenwrtServices
+
+        with metrics.timer("subprocesses", "service.%s" % action):
+            with OpenwrtServices() as services:
+                getattr(services, action)(service)
+
+
+service_scheduler = ServiceScheduler()
+# the timer is a daemon thread => don't lose pending restarts when exiting
+atexit.register(service_scheduler.flush)
+
+
 class DataCollectUci(object):
     MINIPOTS = {"23tcp", "2323tcp", "8123tcp", "8080tcp", "80tcp", "3128tcp"}
     LOG_CREDENTIALS_DEFAULT = False
+    # serializes updates of the ucollect service
+    _service_lock = threading.Lock()
 
     def get_agreed(self):
-        with UciBackend() as backend:
-            foris_data = backend.read("foris")
+        from foris_controller_backends.uci import UciRecordNotFound, parse_bool, get_option_named
+
+        foris_data = uci_snapshots.read("foris")
 
         try:
             return parse_bool(get_option_named(foris_data, "foris", "eula", "agreed_collect"))
@@ -112,23 +832,107 @@ class DataCollectUci(object):
             return False
 
     def set_agreed(self, agreed):
+        """ Updates agreement and enables or disables ucollect accordingly
+
+        Nothing is done when the agreement is not changed.
+
+        :param agreed: user agreed with data collect
+        :type agreed: bool
+        :returns: whether anything was applied
+        :rtype: bool
+        """
+        if not self._store_agreed(agreed):
+            return False
+
+        self._apply_agreed()
+        return True
+
+    def set_agreed_async(self, agreed, exit_notify):
+        """ Updates agreement and enables or disables ucollect in the background
+
+        :param agreed: user agreed with data collect
+        :type agreed: bool
+        :param exit_notify: called with {"job_id": ..., "agreed": ..., "result": ...}
+                            when the service is updated
+        :type exit_notify: callable
+        :returns: (whether anything was applied, job id)
+        :rtype: tuple
+        """
+        applied = self._store_agreed(agreed)
+        job_id = uuid.uuid4().hex
+
+        def worker():
+            result = True
+            if applied:
+                try:
+                    self._apply_agreed(flush=True)
+                except Exception:
+                    logger.exception("Failed to update ucollect service (job %s)." % job_id)
+                    result = False
+            exit_notify({"job_id": job_id, "agreed": agreed, "result": result})
+
+        thread = threading.Thread(target=worker, name="data_collect-set-%s" % job_id)
+        thread.daemon = True
+        thread.start()
+
+        return applied, job_id
+
+    def _get_stored_agreed(self):
+        """ Returns the stored agreement or None when it was never stored """
+        from foris_controller_backends.uci import UciRecordNotFound, parse_bool, get_option_named
+
+        foris_data = uci_snapshots.read("foris")
+
+        try:
+            value = get_option_named(foris_data, "foris", "eula", "agreed_collect", None)
+        except UciRecordNotFound:
+            return None
+        return None if value is None else parse_bool(value)
+
+    def _store_agreed(self, agreed):
+        # missing option differs from any request (explicit opt-out has to be applied too)
+        if self._get_stored_agreed() == agreed:
+            return False
+
+        from foris_controller_backends.uci import UciBackend, store_bool
+
         with UciBackend() as backend:
             backend.add_section("foris", "config", "eula")
             backend.set_option("foris", "eula", "agreed_collect", store_bool(agreed))
+        uci_snapshots.invalidate("foris")
+        return True
 
-        with OpenwrtServices() as services:
-            if agreed:
-                services.enable("ucollect")
-                services.restart("ucollect")
-            else:
-                services.disable("ucollect")
-                services.stop("ucollect")
+    def _apply_agreed(self, flush=False):
+        """ Enables or disables ucollect according to the stored agreement
 
-        return True
+        The agreement is read again under the lock, so the service ends up
+        in the state of the last stored agreement even when the updates
+        of several requests overlap.
+
+        :param flush: perform the scheduled restart right away
+        :type flush: bool
+        """
+        with DataCollectUci._service_lock:
+            agreed = self.get_agreed()
+            self._update_service(agreed)
+            service_scheduler.schedule("ucollect", "restart" if agreed else "stop")
+            if flush:
+                service_scheduler.flush()
+
+    def _update_service(self, agreed):
+        from foris_controller_backends.services import OpenwrtServices
+
+        action = "enable" if agreed else "disable"
+        with metrics.timer("subprocesses", "service.%s" % action):
+            with OpenwrtServices() as services:
+                getattr(services, action)("ucollect")
 
     def get_honeypots(self):
-        with UciBackend() as backend:
-            ucollect_data = backend.read("ucollect")
+        from foris_controller_backends.uci import (
+            UciRecordNotFound, parse_bool, get_option_named, store_bool
+        )
+
+        ucollect_data = uci_snapshots.read("ucollect")
 
         try:
             log_credentials = parse_bool(get_option_named(
@@ -155,8 +959,25 @@ class DataCollectUci(object):
         }
 
     def set_honeypots(self, honeypot_data):
+        """ Updates honeypots configuration and restarts ucollect
+
+        Nothing is done when the configuration is not changed.
+
+        :param honeypot_data: {"minipots": {...}, "log_credentials": True/False}
+        :type honeypot_data: dict
+        :returns: whether anything was applied
+        :rtype: bool
+        """
+        current = self.get_honeypots()
+        if current["log_credentials"] == honeypot_data["log_credentials"] and all(
+            current["minipots"].get(k) == v for k, v in honeypot_data["minipots"].items()
+        ):
+            return False
+
         disabled_minipots = [k for k, v in honeypot_data["minipots"].items() if not v]
 
+        from foris_controller_backends.uci import UciBackend, store_bool
+
         with UciBackend() as backend:
             backend.add_section("ucollect", "fakes", "fakes")
             backend.replace_list("ucollect", "fakes", "disable", disabled_minipots)
@@ -164,9 +985,9 @@ class DataCollectUci(object):
                 "ucollect", "fakes", "log_credentials",
                 store_bool(honeypot_data["log_credentials"]),
             )
+        uci_snapshots.invalidate("ucollect")
 
-        with OpenwrtServices() as services:
-            services.restart("ucollect")
+        service_scheduler.schedule("ucollect", "restart")
 
         return True
 
@@ -174,49 +995,229 @@ class DataCollectUci(object):
 class SendingFiles(BaseFile):
     FW_PATH = "/tmp/firewall-turris-status.txt"
     UC_PATH = "/tmp/ucollect-status"
-    file_lock = RWLock(app_info["lock_backend"])
+    # created on the first use (see _get_lock)
+    file_lock = None
+    _file_lock_guard = threading.Lock()
     STATE_ONLINE = "online"
     STATE_OFFLINE = "offline"
     STATE_UNKNOWN = "unknown"
 
-    @readlock(file_lock, logger)
+    def __init__(self):
+        # path -> ((st_mtime_ns, st_size, st_ino), parsed status)
+        self._parsed = {}
+
     def get_sending_info(self):
         """ Returns sending info
 
+        Files are parsed again only when they change.
+
         :returns: sending info
         :rtype: dict
         """
-        result = {
-            'firewall_status': {"state": SendingFiles.STATE_UNKNOWN, "last_check": 0},
-            'ucollect_status': {"state": SendingFiles.STATE_UNKNOWN, "last_check": 0},
+        return {
+            'firewall_status': self._get_status(SendingFiles.FW_PATH, self._parse_firewall),
+            'ucollect_status': self._get_status(SendingFiles.UC_PATH, self._parse_ucollect),
         }
+
+    @classmethod
+    def _get_lock(cls):
+        with cls._file_lock_guard:
+            if cls.file_lock is None:
+                cls.file_lock = RWLock(app_info["lock_backend"])
+            return cls.file_lock
+
+    def _read(self, path):
+        requested = time.perf_counter()
+        with self._get_lock().readlock:
+            metrics.observe("locks", "sending_files.file_lock", time.perf_counter() - requested)
+            return self._file_content(path)
+
+    def _get_status(self, path, parse):
         try:
-            content = self._file_content(SendingFiles.FW_PATH)
-            if re.search(r"turris firewall working: yes", content):
-                result['firewall_status']["state"] = SendingFiles.STATE_ONLINE
-            else:
-                result['firewall_status']["state"] = SendingFiles.STATE_OFFLINE
-            match = re.search(r"last working timestamp: ([0-9]+)", content)
-            if match:
-                result['firewall_status']["last_check"] = int(match.group(1))
-        except IOError:
+            stat = os.stat(inject_file_root(path))
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            cached = self._parsed.get(path)
+            if cached and cached[0] == stamp:
+                return dict(cached[1])
+            status = parse(self._read(path))
+        except (IOError, OSError):
             # file doesn't probably exists yet
-            logger.warning("Failed to read file '%s'." % SendingFiles.FW_PATH)
+            logger.warning("Failed to read file '%s'." % path)
+            self._parsed.pop(path, None)
+            return {"state": SendingFiles.STATE_UNKNOWN, "last_check": 0}
 
-        try:
-            content = self._file_content(SendingFiles.UC_PATH)
-            match = re.search(r"^(\w+)\s+([0-9]+)$", content)
-            if not match:
-                logger.error("Wrong format of file '%s'." % SendingFiles.UC_PATH)
-            else:
-                if match.group(1) == "online":
-                    result['ucollect_status']["state"] = SendingFiles.STATE_ONLINE
-                else:
-                    result['ucollect_status']["state"] = SendingFiles.STATE_OFFLINE
-                result['ucollect_status']["last_check"] = int(match.group(2))
+        self._parsed[path] = (stamp, status)
+        return dict(status)
 
-        except IOError:
-            # file doesn't probably exists yet
-            logger.warning("Failed to read file '%s'." % SendingFiles.UC_PATH)
+    def _parse_firewall(self, content):
+        result = {"state": SendingFiles.STATE_UNKNOWN, "last_check": 0}
+        if re.search(r"turris firewall working: yes", content):
+            result["state"] = SendingFiles.STATE_ONLINE
+        else:
+            result["state"] = SendingFiles.STATE_OFFLINE
+        match = re.search(r"last working timestamp: ([0-9]+)", content)
+        if match:
+            result["last_check"] = int(match.group(1))
+        return result
 
+    def _parse_ucollect(self, content):
+        result = {"state": SendingFiles.STATE_UNKNOWN, "last_check": 0}
+        match = re.search(r"^(\w+)\s+([0-9]+)$", content)
+        if not match:
+            logger.error("Wrong format of file '%s'." % SendingFiles.UC_PATH)
+        else:
+            if match.group(1) == "online":
+                result["state"] = SendingFiles.STATE_ONLINE
+            else:
+                result["state"] = SendingFiles.STATE_OFFLINE
+            result["last_check"] = int(match.group(2))
         return result
+
+
+class SendingStatusWatcher(object):
+    """ Watches sending status files and reports state transitions
+
+    Directories containing the files are watched using inotify. When inotify
+    is not available the files are polled every `poll_interval` seconds.
+    """
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, notify, sending_files=None, poll_interval=POLL_INTERVAL, use_inotify=True):
+        """
+        :param notify: called with the whole sending info when any state changes
+        :type notify: callable
+        """
+        self.notify = notify
+        self.sending_files = sending_files or SendingFiles()
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self._states = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._check()  # initial states are not reported
+        self._thread = threading.Thread(target=self._run, name="data_collect-sending-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _check(self):
+        info = self.sending_files.get_sending_info()
+        states = {k: v["state"] for k, v in info.items()}
+        if self._states is not None and states != self._states:
+            logger.debug("Sending status changed %s -> %s" % (self._states, states))
+            try:
+                self.notify(info)
+            except Exception:
+                logger.exception("Failed to send sending status notification.")
+        self._states = states
+
+    def _watch(self):
+        from .inotify import Inotify, InotifyUnavailable
+
+        try:
+            inotify = Inotify()
+        except InotifyUnavailable as e:
+            logger.warning("Inotify is not available (%s)." % e)
+            return False
+
+        paths = [SendingFiles.FW_PATH, SendingFiles.UC_PATH]
+        names = {os.path.basename(e) for e in paths}
+        try:
+            for directory in {os.path.dirname(inject_file_root(e)) for e in paths}:
+                inotify.add_watch(directory)
+        except OSError as e:
+            logger.warning("Failed to watch sending status files (%s)." % e)
+            inotify.close()
+            return False
+
+        try:
+            while not self._stop.is_set():
+                events = inotify.read(self.poll_interval)
+                if not events or any(name in names for _, _, name in events):
+                    self._check()
+        finally:
+            inotify.close()
+        return True
+
+    def _run(self):
+        if self.use_inotify and self._watch():
+            return
+        logger.debug("Polling sending status files.")
+        while not self._stop.wait(self.poll_interval):
+            self._check()
+
+
+class SendingSampler(object):
+    """ Periodically records sending states into SendingHistory and AvailabilityStats
+
+    Functions in `listeners` are called with (timestamp, firewall state, ucollect state)
+    after each sample.
+    """
+    INTERVAL = 60.0
+    HISTORY_SIZE = 7 * 24 * 60
+
+    def __init__(self, sending_files=None, interval=None, capacity=None, persist_path=None):
+        from .history import SendingHistory, AvailabilityStats
+
+        self.sending_files = sending_files or SendingFiles()
+        self.interval = interval if interval is not None else _env_number(
+            "FORIS_DATA_COLLECT_HISTORY_INTERVAL", SendingSampler.INTERVAL
+        )
+        self.history = SendingHistory(capacity if capacity is not None else _env_number(
+            "FORIS_DATA_COLLECT_HISTORY_SIZE", SendingSampler.HISTORY_SIZE, int
+        ))
+        self.persist_path = persist_path or os.environ.get("FORIS_DATA_COLLECT_HISTORY_PATH")
+        # longer gaps between samples are not accounted
+        self.stats = AvailabilityStats(max(self.interval, SendingSampler.INTERVAL) * 2)
+        self.listeners = [self.stats.add_sample]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.persist_path and os.path.exists(self.persist_path):
+            if self.history.load(self.persist_path):
+                for record in self.history.records():
+                    self.stats.add_sample(*record)
+        if self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="data_collect-sending-sampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def sample(self):
+        info = self.sending_files.get_sending_info()
+        timestamp = time.time()
+        firewall = info["firewall_status"]["state"]
+        ucollect = info["ucollect_status"]["state"]
+        self.history.append(timestamp, firewall, ucollect)
+        for listener in self.listeners:
+            try:
+                listener(timestamp, firewall, ucollect)
+            except Exception:
+                logger.exception("Sending sample listener failed.")
+
+        if self.persist_path:
+            try:
+                self.history.dump(self.persist_path)
+            except (IOError, OSError) as e:
+                logger.warning("Failed to store sending history (%s)." % e)
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Failed to sample sending status.")
+            if self._stop.wait(self.interval):
+                break
@@ -0,0 +1,54 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Atomic replacement of files """
+
+import os
+import tempfile
+
+
+def write_atomically(path, data, mode=0o600):
+    """ Replaces the file with the data
+
+    A unique temporary file is created next to the target (a predictable name
+    could be a symlink planted by someone else) and it is renamed over it.
+
+    :param path: path to the file
+    :type path: str
+    :param data: new content
+    :type data: bytes
+    :param mode: permissions of the file
+    :type mode: int
+    :raises OSError: when the file can't be written
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".%s." % os.path.basename(path), dir=os.path.dirname(path) or "."
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if mode != 0o600:  # mkstemp creates the file with 0600
+                os.fchmod(f.fileno(), mode)
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,142 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Export of data_collect state in Prometheus text format (node_exporter textfile) """
+
+import logging
+import threading
+
+from .atomic import write_atomically
+from .metrics import metrics as default_metrics, GROUPS
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "foris_data_collect"
+STATES = ["online", "offline", "unknown"]
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusExporter(object):
+    """ Writes data_collect state and call metrics into a textfile
+
+    The file is replaced atomically (temp file + rename) and only when its content changes.
+    """
+
+    def __init__(self, path, sending_files, uci, metrics=None):
+        """
+        :param path: path to the output file (e.g. /var/lib/node_exporter/data_collect.prom)
+        :type path: str
+        :param sending_files: SendingFiles instance
+        :param uci: DataCollectUci instance
+        :param metrics: Metrics instance (process-wide one by default)
+        """
+        self.path = path
+        self.sending_files = sending_files
+        self.uci = uci
+        self.metrics = metrics or default_metrics
+        self._last = None
+        self._lock = threading.Lock()
+
+    def render(self):
+        """ Returns the content of the textfile
+
+        :rtype: str
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP %s_%s %s" % (PREFIX, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (PREFIX, name, kind))
+            for labels, value in samples:
+                label_text = ",".join('%s="%s"' % e for e in labels)
+                lines.append(
+                    "%s_%s%s %s" % (
+                        PREFIX, name, "{%s}" % label_text if label_text else "", _format(value)
+                    )
+                )
+
+        metric("agreed", "gauge", "User agreed with data collection.", [
+            ((), int(self.uci.get_agreed())),
+        ])
+
+        info = self.sending_files.get_sending_info()
+        channels = [("firewall", info["firewall_status"]), ("ucollect", info["ucollect_status"])]
+        metric("sending_state", "gauge", "Current sending state of the channel.", [
+            ((("channel", channel), ("state", state)), int(status["state"] == state))
+            for channel, status in channels for state in STATES
+        ])
+        metric(
+            "last_check_timestamp_seconds", "gauge",
+            "Time of the last successful check of the channel (age = time() - value).",
+            [((("channel", channel),), status["last_check"]) for channel, status in channels],
+        )
+
+        snapshot = self.metrics.snapshot()
+        bounds = snapshot["buckets_ms"]
+        calls = [(group, name, record) for group in GROUPS
+                 for name, record in sorted(snapshot[group].items())]
+        metric("calls_total", "counter", "Number of calls.", [
+            ((("group", group), ("name", name)), record["count"]) for group, name, record in calls
+        ])
+        metric("errors_total", "counter", "Number of failed calls.", [
+            ((("group", group), ("name", name)), record["errors"]) for group, name, record in calls
+        ])
+
+        lines.append("# HELP %s_duration_seconds Duration of calls." % PREFIX)
+        lines.append("# TYPE %s_duration_seconds histogram" % PREFIX)
+        for group, name, record in calls:
+            labels = 'group="%s",name="%s"' % (group, name)
+            cumulative = 0
+            for bound, count in zip(bounds + [None], record["histogram"]):
+                cumulative += count
+                le = "+Inf" if bound is None else _format(bound / 1000.0)
+                lines.append(
+                    '%s_duration_seconds_bucket{%s,le="%s"} %d' % (PREFIX, labels, le, cumulative)
+                )
+            lines.append('%s_duration_seconds_sum{%s} %s' % (
+                PREFIX, labels, _format(record["total_ms"] / 1000.0)
+            ))
+            lines.append('%s_duration_seconds_count{%s} %d' % (PREFIX, labels, record["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """ Writes the textfile if anything changed
+
+        :returns: True if the file was written
+        :rtype: bool
+        """
+        content = self.render()
+        with self._lock:
+            if content == self._last:
+                return False
+
+            write_atomically(self.path, content.encode(), 0o644)
+            self._last = content
+        return True
+
+    def __call__(self, *args):
+        """ Can be used as a SendingSampler listener """
+        try:
+            self.export()
+        except (IOError, OSError) as e:
+            logger.warning("Failed to export data_collect metrics to '%s' (%s)." % (self.path, e))
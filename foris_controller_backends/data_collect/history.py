@@ -0,0 +1,312 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" History of sending states """
+
+import logging
+import struct
+import threading
+
+from array import array
+
+from .atomic import write_atomically
+
+logger = logging.getLogger(__name__)
+
+STATES = ["unknown", "online", "offline"]
+_STATE_CODES = {e: i for i, e in enumerate(STATES)}
+
+
+class SendingHistory(object):
+    """ Fixed-size ring buffer of (timestamp, firewall state, ucollect state)
+
+    Records are stored in preallocated arrays (10 bytes per record),
+    the oldest records are overwritten when the buffer is full.
+    Timestamps are kept non-decreasing (a timestamp older than the last stored
+    one, e.g. after the wall clock was set back, is clamped to it).
+    """
+    _HEADER = struct.Struct("<4sIII")
+    _MAGIC = b"DCSH"
+    VERSION = 1
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._firewall = array("b", bytes(capacity))
+        self._ucollect = array("b", bytes(capacity))
+        self._start = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, firewall, ucollect):
+        """ Stores a record
+
+        :param timestamp: time of the sample
+        :type timestamp: float
+        :param firewall: firewall state ("online", "offline", "unknown")
+        :type firewall: str
+        :param ucollect: ucollect state ("online", "offline", "unknown")
+        :type ucollect: str
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            if self._count:
+                # records() bisects the timestamps
+                timestamp = max(timestamp, self._timestamp(self._count - 1))
+            if self._count < self.capacity:
+                index = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                index = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._timestamps[index] = timestamp
+            self._firewall[index] = _STATE_CODES.get(firewall, 0)
+            self._ucollect[index] = _STATE_CODES.get(ucollect, 0)
+
+    def _timestamp(self, position):
+        return self._timestamps[(self._start + position) % self.capacity]
+
+    def _bisect(self, timestamp, right=False):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            value = self._timestamp(middle)
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, since=None, until=None):
+        """ Returns stored records (oldest first)
+
+        :param since: only records with timestamp >= since
+        :type since: float
+        :param until: only records with timestamp <= until
+        :type until: float
+        :returns: [(timestamp, firewall state, ucollect state), ...]
+        :rtype: list
+        """
+        with self._lock:
+            first = self._bisect(since) if since is not None else 0
+            last = self._bisect(until, right=True) if until is not None else self._count
+            result = []
+            for position in range(first, last):
+                index = (self._start + position) % self.capacity
+                result.append((
+                    self._timestamps[index],
+                    STATES[self._firewall[index]],
+                    STATES[self._ucollect[index]],
+                ))
+            return result
+
+    def dump(self, path):
+        """ Stores the history into a file (atomically)
+
+        :param path: path to the file
+        :type path: str
+        """
+        with self._lock:
+            order = [(self._start + i) % self.capacity for i in range(self._count)]
+            timestamps = array("d", (self._timestamps[i] for i in order))
+            firewall = array("b", (self._firewall[i] for i in order))
+            ucollect = array("b", (self._ucollect[i] for i in order))
+
+        write_atomically(path, b"".join([
+            self._HEADER.pack(self._MAGIC, self.VERSION, self.capacity, len(order)),
+            timestamps.tobytes(),
+            firewall.tobytes(),
+            ucollect.tobytes(),
+        ]))
+
+    def load(self, path):
+        """ Appends records stored in a file, corrupted files are ignored
+
+        :param path: path to the file
+        :type path: str
+        :returns: True if the file was loaded
+        :rtype: bool
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, version, _, count = self._HEADER.unpack_from(data)
+            if magic != self._MAGIC or version != self.VERSION:
+                raise ValueError("unsupported format")
+            offset = self._HEADER.size
+            if len(data) != offset + 10 * count:
+                raise ValueError("wrong size")
+            timestamps = array("d")
+            timestamps.frombytes(data[offset:offset + 8 * count])
+            firewall = array("b")
+            firewall.frombytes(data[offset + 8 * count:offset + 9 * count])
+            ucollect = array("b")
+            ucollect.frombytes(data[offset + 9 * count:])
+        except (IOError, OSError, ValueError, struct.error) as e:
+            logger.warning("Failed to load sending history from '%s' (%s)." % (path, e))
+            return False
+
+        for timestamp, fw, uc in zip(timestamps, firewall, ucollect):
+            if 0 <= fw < len(STATES) and 0 <= uc < len(STATES):
+                self.append(timestamp, STATES[fw], STATES[uc])
+        return True
+
+
+class RollingAvailability(object):
+    """ Availability of a single channel within a rolling time window
+
+    The window is split into `buckets` buckets. Each sample updates only the
+    bucket it falls into, so the update cost doesn't depend on the window size.
+    """
+
+    def __init__(self, window, buckets=60):
+        self.window = window
+        self.buckets = buckets
+        self.width = float(window) / buckets
+        self._ids = array("q", [-1] * buckets)
+        self._observed = array("d", bytes(8 * buckets))
+        self._online = array("d", bytes(8 * buckets))
+        self._transitions = array("L", bytes(array("L").itemsize * buckets))
+        self._outage = array("d", bytes(8 * buckets))
+
+    def _bucket(self, timestamp):
+        bucket_id = int(timestamp // self.width)
+        index = bucket_id % self.buckets
+        if self._ids[index] != bucket_id:
+            self._ids[index] = bucket_id
+            self._observed[index] = 0.0
+            self._online[index] = 0.0
+            self._transitions[index] = 0
+            self._outage[index] = 0.0
+        return index
+
+    def add(self, timestamp, duration, state, transition, outage):
+        """ Accounts a period which ended at `timestamp`
+
+        :param timestamp: end of the period
+        :param duration: length of the period in `state` (0 if unknown)
+        :param state: state during the period
+        :param transition: whether the state changed at `timestamp`
+        :param outage: length of an outage which ended at `timestamp` (0 if none)
+        """
+        index = self._bucket(timestamp)
+        self._observed[index] += duration
+        if state == "online":
+            self._online[index] += duration
+        if transition:
+            self._transitions[index] += 1
+        # capped like the ongoing outage in summary()
+        outage = min(outage, self.window)
+        if outage > self._outage[index]:
+            self._outage[index] = outage
+
+    def summary(self, now, current_outage=0.0):
+        """ Returns statistics of the window which ends at `now`
+
+        :returns: {"online_percent": ..., "transitions": ..., "longest_outage": ...}
+        :rtype: dict
+        """
+        current_id = int(now // self.width)
+        observed = online = outage = 0.0
+        transitions = 0
+        for index in range(self.buckets):
+            if current_id - self.buckets < self._ids[index] <= current_id:
+                observed += self._observed[index]
+                online += self._online[index]
+                transitions += self._transitions[index]
+                outage = max(outage, self._outage[index])
+        return {
+            "online_percent": round(100.0 * online / observed, 3) if observed else None,
+            "transitions": transitions,
+            "longest_outage": max(outage, min(current_outage, self.window)),
+        }
+
+
+class AvailabilityStats(object):
+    """ Availability statistics of firewall and ucollect channels
+
+    Fed by samples (timestamp, firewall state, ucollect state). Time between two
+    samples is accounted to the state of the former one unless the gap is longer
+    than `max_gap` (e.g. when the controller was not running).
+    Outage is a continuous period in the offline state.
+    """
+    CHANNELS = ["firewall", "ucollect"]
+    WINDOWS = [("1h", 60 * 60), ("24h", 24 * 60 * 60), ("7d", 7 * 24 * 60 * 60)]
+
+    def __init__(self, max_gap):
+        self.max_gap = max_gap
+        self._windows = {
+            channel: [(name, RollingAvailability(size)) for name, size in self.WINDOWS]
+            for channel in self.CHANNELS
+        }
+        self._last = {channel: None for channel in self.CHANNELS}  # (timestamp, state)
+        self._outage_start = {channel: None for channel in self.CHANNELS}
+        self._lock = threading.Lock()
+
+    def add_sample(self, timestamp, firewall, ucollect):
+        with self._lock:
+            for channel, state in zip(self.CHANNELS, [firewall, ucollect]):
+                self._add(channel, timestamp, state)
+
+    def _add(self, channel, timestamp, state):
+        last = self._last[channel]
+        duration = 0.0
+        transition = False
+        outage = 0.0
+        if last:
+            last_timestamp, last_state = last
+            gap = timestamp - last_timestamp
+            if 0 <= gap <= self.max_gap:
+                duration = gap
+            transition = state != last_state
+
+        outage_start = self._outage_start[channel]
+        if state == "offline":
+            if outage_start is None:
+                self._outage_start[channel] = timestamp
+        elif outage_start is not None:
+            outage = timestamp - outage_start
+            self._outage_start[channel] = None
+
+        for _, window in self._windows[channel]:
+            window.add(timestamp, duration, last[1] if last else state, transition, outage)
+        self._last[channel] = (timestamp, state)
+
+    def summary(self, now):
+        """ Returns statistics of all channels and windows
+
+        :param now: end of the windows
+        :type now: float
+        :returns: {channel: {window: {"online_percent", "transitions", "longest_outage"}}}
+        :rtype: dict
+        """
+        with self._lock:
+            result = {}
+            for channel in self.CHANNELS:
+                outage_start = self._outage_start[channel]
+                current_outage = now - outage_start if outage_start is not None else 0.0
+                result[channel] = {
+                    name: window.summary(now, current_outage)
+                    for name, window in self._windows[channel]
+                }
+            return result
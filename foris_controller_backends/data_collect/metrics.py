@@ -0,0 +1,143 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Lightweight call counters and latency histograms """
+
+import bisect
+import threading
+import time
+
+from functools import wraps
+
+# upper bounds of histogram buckets in milliseconds (the last bucket is unbounded)
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+GROUPS = ["handlers", "subprocesses", "locks"]
+
+
+class _Timer(object):
+    def __init__(self):
+        self.error = False
+
+
+class Metrics(object):
+    """ Call counts, error counts and latency histograms grouped by GROUPS """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {group: {} for group in GROUPS}
+
+    def observe(self, group, name, seconds, error=False):
+        """ Records a single call
+
+        :param group: one of GROUPS
+        :type group: str
+        :param name: name of the call
+        :type name: str
+        :param seconds: duration of the call
+        :type seconds: float
+        :param error: whether the call failed
+        :type error: bool
+        """
+        ms = seconds * 1000
+        bucket = bisect.bisect_left(BUCKETS_MS, ms)
+        with self._lock:
+            record = self._data[group].get(name)
+            if record is None:
+                # [count, errors, total_ms, max_ms, histogram]
+                record = [0, 0, 0.0, 0.0, [0] * (len(BUCKETS_MS) + 1)]
+                self._data[group][name] = record
+            record[0] += 1
+            record[1] += 1 if error else 0
+            record[2] += ms
+            record[3] = max(record[3], ms)
+            record[4][bucket] += 1
+
+    def timer(self, group, name):
+        """ Context manager which records the duration of its block
+
+        Set `error` attribute of the returned object to mark the call as failed,
+        exceptions raised within the block are marked automatically.
+        """
+        return _TimerContext(self, group, name)
+
+    def timed(self, group, name=None):
+        """ Decorator which records durations of function calls """
+
+        def outer(func):
+            call_name = name or func.__name__
+
+            @wraps(func)
+            def inner(*args, **kwargs):
+                with self.timer(group, call_name):
+                    return func(*args, **kwargs)
+
+            return inner
+
+        return outer
+
+    def snapshot(self):
+        """ Returns the current values
+
+        :returns: {"buckets_ms": [...], group: {name: {"count", "errors", "total_ms", "max_ms",
+                   "histogram"}}}
+        :rtype: dict
+        """
+        with self._lock:
+            result = {"buckets_ms": list(BUCKETS_MS)}
+            for group, records in self._data.items():
+                result[group] = {
+                    name: {
+                        "count": count,
+                        "errors": errors,
+                        "total_ms": round(total, 3),
+                        "max_ms": round(maximum, 3),
+                        "histogram": list(histogram),
+                    }
+                    for name, (count, errors, total, maximum, histogram) in records.items()
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._data = {group: {} for group in GROUPS}
+
+
+class _TimerContext(object):
+    def __init__(self, metrics, group, name):
+        self.metrics = metrics
+        self.group = group
+        self.name = name
+
+    def __enter__(self):
+        self.timer = _Timer()
+        self.start = time.perf_counter()
+        return self.timer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(
+            self.group,
+            self.name,
+            time.perf_counter() - self.start,
+            self.timer.error or exc_type is not None,
+        )
+        return False
+
+
+# shared by the whole process
+metrics = Metrics()
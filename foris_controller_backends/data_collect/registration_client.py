@@ -0,0 +1,157 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" HTTP client for registration lookups which keeps connections alive """
+
+import http.client
+import logging
+import ssl
+import threading
+
+from urllib.parse import quote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationQueryFailed(Exception):
+    pass
+
+
+class RegistrationHttpClient(object):
+    """ Queries the registration server over pooled keep-alive connections
+
+    The URL template may contain {code}, {email} and {language} placeholders
+    (values are URL-quoted), e.g.:
+
+        https://example.com/lookup?registration_code={code}&email={email}&lang={language}
+
+    The response body is expected in the same format as registered.sh output
+    ("status: ..." and "url: ..." lines).
+    """
+    POOL_SIZE = 4
+
+    def __init__(self, url_template, timeout=10.0, pool_size=None, ssl_context=None):
+        """
+        :param url_template: http(s) URL with placeholders
+        :type url_template: str
+        :param timeout: socket timeout in seconds
+        :type timeout: float
+        :param pool_size: max number of idle connections kept open
+        :type pool_size: int
+        :param ssl_context: context of https connections (system defaults if None)
+        :raises ValueError: when the URL or its placeholders are not supported
+        """
+        parts = urlsplit(url_template)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Unsupported registration URL '%s'" % url_template)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path_template = parts.path or "/"
+        if parts.query:
+            self.path_template += "?" + parts.query
+        try:
+            self.path_template.format(code="", email="", language="")
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError("Wrong placeholder in registration URL '%s' (%r)" % (url_template, e))
+        self.timeout = timeout
+        self.pool_size = self.POOL_SIZE if pool_size is None else pool_size
+        self.ssl_context = ssl_context
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.https:
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def _request(self, connection, path, timeout):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request("GET", path, headers={"Connection": "keep-alive"})
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, body.decode(errors="replace"), response.will_close
+
+    def query(self, code, email, language, timeout=None):
+        """ Queries the registration server
+
+        :param code: registration code of the router
+        :type code: str
+        :param email: email which will be used in the query
+        :type email: str
+        :param language: language which will be used in the query
+        :type language: str
+        :param timeout: socket timeout of this query if it is shorter than the default one
+        :type timeout: float
+        :returns: (HTTP status code, response body)
+        :rtype: tuple
+        :raises RegistrationQueryFailed: when the server is not reachable
+        """
+        path = self.path_template.format(
+            code=quote(code, safe=""), email=quote(email, safe=""),
+            language=quote(language, safe=""),
+        )
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        connection, reused = self._acquire()
+        try:
+            status, body, will_close = self._request(connection, path, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            if not reused:
+                raise RegistrationQueryFailed(e)
+            # the server might have closed the idle connection, retry with a new one
+            logger.debug("Idle registration server connection failed, reconnecting.")
+            connection = self._connect()
+            try:
+                status, body, will_close = self._request(connection, path, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise RegistrationQueryFailed(e)
+
+        if will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return status, body
+
+    def close(self):
+        """ Closes idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
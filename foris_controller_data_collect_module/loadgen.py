@@ -0,0 +1,367 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Load generator for data_collect module of a running foris-controller
+
+Example (controller started with the mock backend on a unix socket):
+
+    python -m foris_controller_data_collect_module.loadgen \\
+        --bus unix-socket --path /tmp/foris-controller.soc \\
+        --clients 8 --duration 30 --mix get=5,get_honeypots=2,get_registered=1
+
+Requires foris-client (and ubus / paho-mqtt for the respective buses).
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODULE = "data_collect"
+BUSES = ["unix-socket", "ubus", "mqtt"]
+DEFAULT_MIX = "get=4,get_all=2,get_honeypots=2,get_registered=1,get_sending_stats=1"
+PERCENTILES = [50, 90, 95, 99]
+
+
+def _payloads(email, language):
+    """ Returns data factories of the supported actions (called with random.Random) """
+    return {
+        "get": lambda rng: None,
+        "get_all": lambda rng: None,
+        "get_honeypots": lambda rng: None,
+        "get_sending_history": lambda rng: None,
+        "get_sending_stats": lambda rng: None,
+        "get_metrics": lambda rng: None,
+        "get_registration_server_status": lambda rng: None,
+        "get_registered": lambda rng: {"email": email, "language": language},
+        "set": lambda rng: {"agreed": rng.random() < 0.5},
+    }
+
+
+def parse_mix(text, actions):
+    """ Parses action mix
+
+    :param text: "action=weight,action=weight,..." (weight defaults to 1)
+    :type text: str
+    :param actions: supported actions
+    :type actions: list
+    :returns: [(action, weight), ...]
+    :rtype: list
+    :raises ValueError: on unknown action or invalid weight
+    """
+    mix = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        action, _, weight = item.partition("=")
+        action = action.strip()
+        if action not in actions:
+            raise ValueError(
+                "Unknown action '%s' (supported: %s)" % (action, ", ".join(sorted(actions)))
+            )
+        weight = float(weight) if weight.strip() else 1.0
+        if weight < 0:
+            raise ValueError("Negative weight of '%s'" % action)
+        if weight > 0:
+            mix.append((action, weight))
+    if not mix:
+        raise ValueError("Empty action mix")
+    return mix
+
+
+def percentile(ordered, p):
+    """ Returns p-th percentile of sorted values (None if empty) """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _summary(latencies, errors):
+    ordered = sorted(latencies)
+    res = {"count": len(ordered), "errors": errors}
+    for p in PERCENTILES:
+        value = percentile(ordered, p)
+        res["p%d_ms" % p] = round(value * 1000, 3) if value is not None else None
+    res["max_ms"] = round(ordered[-1] * 1000, 3) if ordered else None
+    return res
+
+
+class LoadGenerator(object):
+    """ Sends a weighted mix of data_collect requests with concurrent clients
+
+    Each client has its own sender (senders are not shared between threads) and
+    sends requests one after another until the duration or the request count
+    is reached.
+    """
+
+    def __init__(
+        self, sender_factory, mix, payloads, clients=1, duration=None, requests=None, seed=None,
+    ):
+        """
+        :param sender_factory: creates a foris-client sender (called once per client),
+                               request timeout is the default timeout of the sender
+        :type sender_factory: callable
+        :param mix: [(action, weight), ...]
+        :type mix: list
+        :param payloads: {action: data factory}
+        :type payloads: dict
+        :param clients: number of concurrent clients
+        :type clients: int
+        :param duration: how long to send requests (seconds)
+        :type duration: float
+        :param requests: total number of requests to send
+        :type requests: int
+        :param seed: seed of random choices
+        :type seed: int
+        """
+        if duration is None and requests is None:
+            raise ValueError("Either duration or requests has to be set")
+        self.sender_factory = sender_factory
+        self.actions = [e[0] for e in mix]
+        self.weights = [e[1] for e in mix]
+        self.payloads = payloads
+        self.clients = clients
+        self.duration = duration
+        self.requests = requests
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._deadline = None
+        self._start = None
+        self._sent = 0
+        self._latencies = {}
+        self._errors = {}
+
+    def _next(self):
+        with self._lock:
+            if self.requests is not None and self._sent >= self.requests:
+                return False
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                return False
+            self._sent += 1
+            return True
+
+    def _client(self, index, barrier):
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        latencies = {action: [] for action in self.actions}
+        errors = {}
+        sender = None
+        try:
+            sender = self.sender_factory()
+        except Exception as e:
+            errors[("connect", type(e).__name__)] = 1
+            logger.warning("Client %d failed to connect (%s)." % (index, e))
+        barrier.wait()
+
+        while sender is not None and self._next():
+            action = rng.choices(self.actions, self.weights)[0]
+            data = self.payloads[action](rng)
+            start = time.perf_counter()
+            try:
+                sender.send(MODULE, action, data)
+            except Exception as e:
+                key = (action, type(e).__name__)
+                errors[key] = errors.get(key, 0) + 1
+                logger.debug("Request '%s' failed (%s)." % (action, e))
+            else:
+                latencies[action].append(time.perf_counter() - start)
+
+        if sender is not None:
+            try:
+                sender.disconnect()
+            except Exception:
+                pass
+
+        with self._lock:
+            for action, values in latencies.items():
+                self._latencies.setdefault(action, []).extend(values)
+            for key, count in errors.items():
+                self._errors[key] = self._errors.get(key, 0) + count
+
+    def run(self):
+        """ Generates the load
+
+        :returns: {"clients", "elapsed", "requests", "errors", "throughput", "overall": {...},
+                   "actions": {action: {...}}, "error_types": {"action:ExceptionName": count}}
+        :rtype: dict
+        """
+        def started():
+            # called when all the clients are connected
+            self._start = time.perf_counter()
+            if self.duration is not None:
+                self._deadline = time.monotonic() + self.duration
+
+        barrier = threading.Barrier(self.clients, action=started)
+        threads = [
+            threading.Thread(target=self._client, args=(index, barrier), daemon=True)
+            for index in range(self.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - self._start
+
+        errors_by_action = {}
+        for (action, _), count in self._errors.items():
+            errors_by_action[action] = errors_by_action.get(action, 0) + count
+        ok = sum(len(e) for e in self._latencies.values())
+        failed = sum(self._errors.values())
+
+        return {
+            "clients": self.clients,
+            "elapsed": round(elapsed, 3),
+            "requests": ok + failed,
+            "errors": failed,
+            "throughput": round(ok / elapsed, 3) if elapsed else 0.0,
+            "overall": _summary(
+                [v for values in self._latencies.values() for v in values], failed
+            ),
+            "actions": {
+                action: _summary(values, errors_by_action.get(action, 0))
+                for action, values in sorted(self._latencies.items())
+            },
+            "error_types": {
+                "%s:%s" % key: count for key, count in sorted(self._errors.items())
+            },
+        }
+
+
+def format_report(report):
+    """ Formats the result of LoadGenerator.run() as a text table """
+    columns = ["count", "errors"] + ["p%d_ms" % p for p in PERCENTILES] + ["max_ms"]
+    lines = [
+        "clients: %(clients)d  elapsed: %(elapsed).3fs  requests: %(requests)d  "
+        "errors: %(errors)d  throughput: %(throughput).1f req/s" % report,
+        "",
+        "%-22s" % "action" + "".join("%11s" % e for e in columns),
+    ]
+
+    def row(name, summary):
+        cells = []
+        for column in columns:
+            value = summary[column]
+            cells.append("%11s" % ("-" if value is None else value))
+        lines.append("%-22s" % name + "".join(cells))
+
+    for action, summary in report["actions"].items():
+        row(action, summary)
+    row("TOTAL", report["overall"])
+
+    if report["error_types"]:
+        lines.append("")
+        lines.append("errors:")
+        for key, count in report["error_types"].items():
+            lines.append("  %s %d" % (key, count))
+    return "\n".join(lines)
+
+
+def make_sender_factory(bus, path=None, host="localhost", port=1883, controller_id=None,
+                        timeout=None):
+    """ Returns a function which creates a foris-client sender of the given bus
+
+    :param timeout: request timeout in seconds (None = wait forever)
+    :type timeout: float
+    """
+    default_timeout = int(timeout * 1000) if timeout else 0  # foris-client uses ms
+    if bus == "unix-socket":
+        from foris_client.buses.unix_socket import UnixSocketSender
+        path = path or "/tmp/foris-controller.soc"
+        return lambda: UnixSocketSender(path, default_timeout=default_timeout)
+    elif bus == "ubus":
+        from foris_client.buses.ubus import UbusSender
+        path = path or "/var/run/ubus.sock"
+        return lambda: UbusSender(path, default_timeout=default_timeout)
+    elif bus == "mqtt":
+        from foris_client.buses.mqtt import MqttSender
+        return lambda: MqttSender(
+            host, port, default_timeout=default_timeout, controller_id=controller_id,
+        )
+    raise ValueError("Unknown bus '%s'" % bus)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="foris-data-collect-loadgen",
+        description="Sends a mix of data_collect requests to a running foris-controller.",
+    )
+    parser.add_argument("--bus", choices=BUSES, default="unix-socket")
+    parser.add_argument("--path", help="socket path (unix-socket, ubus)")
+    parser.add_argument("--host", default="localhost", help="MQTT host")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT port")
+    parser.add_argument("--controller-id", help="MQTT controller id")
+    parser.add_argument("-c", "--clients", type=int, default=1, help="concurrent clients")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-d", "--duration", type=float, help="seconds to run (default 10)")
+    group.add_argument("-n", "--requests", type=int, help="total number of requests")
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX, help="action=weight,... (default %s)" % DEFAULT_MIX
+    )
+    parser.add_argument("--timeout", type=float, help="timeout of a single request (seconds)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--email", default="loadgen@example.com")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.WARNING)
+
+    if options.clients < 1:
+        parser.error("--clients has to be positive")
+    payloads = _payloads(options.email, options.language)
+    try:
+        mix = parse_mix(options.mix, payloads.keys())
+    except ValueError as e:
+        parser.error(str(e))
+
+    if options.bus == "mqtt" and not options.controller_id:
+        parser.error("--controller-id is required for mqtt")
+
+    try:
+        sender_factory = make_sender_factory(
+            options.bus, options.path, options.host, options.port, options.controller_id,
+            options.timeout,
+        )
+    except ImportError as e:
+        parser.error("foris-client with %s support is required (%s)" % (options.bus, e))
+    duration = options.duration
+    if duration is None and options.requests is None:
+        duration = 10.0
+    generator = LoadGenerator(
+        sender_factory, mix, payloads, clients=options.clients, duration=duration,
+        requests=options.requests, seed=options.seed,
+    )
+    report = generator.run()
+
+    if options.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report))
+    return 0 if report["requests"] and not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
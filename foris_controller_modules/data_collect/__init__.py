@@ -18,6 +18,10 @@
 #
 
 import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from foris_controller.module_base import BaseModule
 from foris_controller.handler_base import wrap_required_functions
@@ -26,14 +30,62 @@ from foris_controller.handler_base import wrap_required_functions
 class DataCollectModule(BaseModule):
     logger = logging.getLogger(__name__)
 
+    # shared among all instances, created on the first use
+    POOL_SIZE = 4
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super(DataCollectModule, self).__init__(*args, **kwargs)
+
+        if os.environ.get("FORIS_DATA_COLLECT_WATCH_SENDING", "0") == "1":
+
+            def notify(msg):
+                self.notify("sending_status_changed", msg)
+
+            self.handler.watch_sending_status(notify)
+
+        # otherwise the history is recorded since the first request which needs it
+        if os.environ.get("FORIS_DATA_COLLECT_SAMPLE_SENDING", "0") == "1" or os.environ.get(
+            "FORIS_DATA_COLLECT_PROMETHEUS_PATH"
+        ):
+            self.handler.start_sending_sampler()
+
+    @classmethod
+    def _get_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(
+                    max_workers=cls.POOL_SIZE, thread_name_prefix="data_collect"
+                )
+            return cls._pool
+
+    def _gather(self, *calls):
+        """ Runs independent handler calls in parallel
+
+        :param calls: functions without arguments
+        :returns: list of results in the same order as calls
+        :rtype: list
+        :raises: exception of the first failed call (in the order of calls)
+        """
+        pool = self._get_pool()
+        futures = [pool.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
     def action_get_registered(self, data):
         """ Obtains information whether a user(email) appears to have this device registered.
-        :param data: {email:..., language:...}
+        :param data: {email:..., language:..., timeout:...}
         :type data: dict
         :returns: status and sometimes url to register the device
         :rtype: dict
         """
-        return self.handler.get_registered(data["email"], data["language"])
+
+        def notify(msg):
+            self.notify("registration_changed", msg)
+
+        return self.handler.get_registered(
+            data["email"], data["language"], notify, data.get("timeout")
+        )
 
     def action_get(self, data):
         """ Get information whether user allowd to collect data
@@ -42,21 +94,99 @@ class DataCollectModule(BaseModule):
         :returns: info about data collecting
         :rtype: dict
         """
-        res = {"agreed": self.handler.get_agreed()}
-        res.update(self.handler.get_sending_info())
+        agreed, sending_info = self._gather(
+            self.handler.get_agreed, self.handler.get_sending_info
+        )
+        res = {"agreed": agreed}
+        res.update(sending_info)
         return res
 
+    def action_get_all(self, data):
+        """ Get all information about data collect in one call
+        :param data: {["registration": {"email": ..., "language": ...}]}
+        :type data: dict
+        :returns: {"agreed": ..., "firewall_status": ..., "ucollect_status": ...,
+                   "honeypots": ..., ["registration": ...]}
+        :rtype: dict
+        """
+        pool = self._get_pool()
+        futures = [
+            pool.submit(call) for call in (
+                self.handler.get_agreed, self.handler.get_sending_info, self.handler.get_honeypots
+            )
+        ]
+        registration = data.get("registration")
+        if registration:
+            # the lookup can take long => it is not run in the shared pool
+            registration = self.action_get_registered(registration)
+        agreed, sending_info, honeypots = [future.result() for future in futures]
+
+        res = {"agreed": agreed, "honeypots": honeypots}
+        res.update(sending_info)
+        if registration:
+            res["registration"] = registration
+        return res
+
+    def action_get_sending_history(self, data):
+        """ Get recorded history of the sending status
+        :param data: {["from": timestamp], ["to": timestamp]}
+        :type data: dict
+        :returns: {"interval": ..., "capacity": ..., "records": [{timestamp, firewall, ucollect}]}
+        :rtype: dict
+        """
+        return self.handler.get_sending_history(data.get("from"), data.get("to"))
+
+    def action_get_sending_stats(self, data):
+        """ Get availability statistics of firewall and ucollect uplinks
+        :param data: {}
+        :type data: dict
+        :returns: {"firewall": {"1h": {...}, "24h": {...}, "7d": {...}}, "ucollect": {...}}
+        :rtype: dict
+        """
+        return self.handler.get_sending_stats()
+
+    def action_get_metrics(self, data):
+        """ Get call counts and latencies of handler methods, subprocesses and locks
+        :param data: {}
+        :type data: dict
+        :returns: {"buckets_ms": [...], "handlers": {...}, "subprocesses": {...}, "locks": {...}}
+        :rtype: dict
+        """
+        return self.handler.get_metrics()
+
+    def action_get_registration_server_status(self, data):
+        """ Get state of the registration server circuit breaker
+        :param data: {}
+        :type data: dict
+        :returns: {"state": "closed"/"open"/"half_open", "failures": ..., "opened_at": ...,
+                   "retry_in": ...}
+        :rtype: dict
+        """
+        return self.handler.get_registration_server_status()
+
     def action_set(self, data):
         """ Update configuration of data collect
-        :param data: {"agreed": True/False}
+
+        In async mode the ucollect service is updated in the background
+        and "set_finished" notification is sent afterwards.
+
+        :param data: {"agreed": True/False, "async": True/False}
         :type data: dict
-        :returns: {"result": True / False}
+        :returns: {"result": True / False, "applied": True / False, ["job_id": "..."]}
         :rtype: dict
         """
-        res = self.handler.set_agreed(data["agreed"])
-        if res:
-            self.notify("set", data)
-        return {"result": res}
+        if data.get("async", False):
+
+            def exit_notify(msg):
+                self.notify("set_finished", msg)
+
+            res = self.handler.set_agreed_async(data["agreed"], exit_notify)
+        else:
+            res = self.handler.set_agreed(data["agreed"])
+
+        if res["applied"]:
+            self.notify("set", {"agreed": data["agreed"]})
+        return res
 
     def action_get_honeypots(self, data):
         """ Get configuration of honeypots
@@ -71,22 +201,29 @@ class DataCollectModule(BaseModule):
         """ Update configuration of honeypots
         :param data: {"minipots": {...}, "log_credentials": True/False}
         :type data: dict
-        :returns: {"result": True / False}
+        :returns: {"result": True / False, "applied": True / False}
         :rtype: dict
         """
         res = self.handler.set_honeypots(data)
-        if res:
+        if res["applied"]:
             self.notify("set_honeypots", data)
-        return {"result": res}
+        return res
 
 
 @wrap_required_functions([
     'get_registered',
     'get_agreed',
     'set_agreed',
+    'set_agreed_async',
     'get_honeypots',
     'set_honeypots',
     'get_sending_info',
+    'watch_sending_status',
+    'start_sending_sampler',
+    'get_sending_history',
+    'get_sending_stats',
+    'get_metrics',
+    'get_registration_server_status',
 ])
 class Handler(object):
     pass
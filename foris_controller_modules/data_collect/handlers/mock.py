@@ -17,8 +17,15 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 #
 
+import json
 import logging
+import os
 import random
+import threading
+import time
+import uuid
+
+from functools import wraps
 
 from foris_controller.handler_base import BaseMockHandler
 from foris_controller.utils import logger_wrapper
@@ -28,10 +35,136 @@ from .. import Handler
 logger = logging.getLogger(__name__)
 
 
+class MockFailure(Exception):
+    pass
+
+
+class MockTimeout(MockFailure):
+    pass
+
+
+class MockBehavior(object):
+    """ Simulated latency and failures of mocked calls
+
+    Configured by FORIS_DATA_COLLECT_MOCK_CONFIG env variable which contains
+    either a JSON object or a path to a file with it:
+
+        {
+            "seed": 42,
+            "timeout_ms": 30000,
+            "default": {"latency": {...}, "failure_rate": 0.0, "timeout_rate": 0.0},
+            "methods": {"get_registered": {"latency": {...}, "failure_rate": 0.1}, ...}
+        }
+
+    Latency distributions (in milliseconds):
+        {"distribution": "constant", "ms": 10}
+        {"distribution": "uniform", "min_ms": 5, "max_ms": 50}
+        {"distribution": "normal", "mean_ms": 20, "stddev_ms": 5}
+        {"distribution": "exponential", "mean_ms": 20}
+        {"distribution": "lognormal", "median_ms": 20, "sigma": 0.5}
+
+    A timed out call sleeps for `timeout_ms` and raises MockTimeout,
+    a failed call raises MockFailure after its latency.
+    """
+    ENV = "FORIS_DATA_COLLECT_MOCK_CONFIG"
+    TIMEOUT_MS = 30000
+    DISTRIBUTIONS = ["constant", "uniform", "normal", "exponential", "lognormal"]
+
+    def __init__(self, config=None):
+        """
+        :param config: configuration (read from the env variable if None)
+        :type config: dict
+        :raises ValueError: when the configuration is not valid
+        """
+        config = self._load() if config is None else self._check(config)
+        self.timeout_ms = config.get("timeout_ms", self.TIMEOUT_MS)
+        self.default = config.get("default", {})
+        self.methods = config.get("methods", {})
+        self.random = random.Random(config.get("seed"))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _load(cls):
+        value = os.environ.get(cls.ENV, "").strip()
+        if not value:
+            return {}
+        try:
+            if not value.startswith("{"):
+                with open(value) as f:
+                    value = f.read()
+            return cls._check(json.loads(value))
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Failed to load mock configuration from %s (%s)." % (cls.ENV, e))
+            return {}
+
+    @classmethod
+    def _check(cls, config):
+        if not isinstance(config, dict):
+            raise ValueError("object expected")
+        specs = [config.get("default", {})] + list(config.get("methods", {}).values())
+        for spec in specs:
+            distribution = spec.get("latency", {}).get("distribution", "constant")
+            if distribution not in cls.DISTRIBUTIONS:
+                raise ValueError("unknown latency distribution '%s'" % distribution)
+        return config
+
+    def _latency(self, spec):
+        distribution = spec.get("distribution", "constant")
+        if distribution == "constant":
+            ms = spec.get("ms", 0)
+        elif distribution == "uniform":
+            ms = self.random.uniform(spec.get("min_ms", 0), spec.get("max_ms", 0))
+        elif distribution == "normal":
+            ms = self.random.gauss(spec.get("mean_ms", 0), spec.get("stddev_ms", 0))
+        elif distribution == "exponential":
+            mean = spec.get("mean_ms", 0)
+            ms = self.random.expovariate(1.0 / mean) if mean > 0 else 0
+        else:  # lognormal
+            median = spec.get("median_ms", 0)
+            ms = median * self.random.lognormvariate(0, spec.get("sigma", 0)) if median > 0 else 0
+        return max(ms, 0) / 1000.0
+
+    def plan(self, method):
+        """ Draws the outcome of a single call
+
+        :param method: name of the mocked method
+        :type method: str
+        :returns: (delay in seconds, None / MockFailure / MockTimeout)
+        :rtype: tuple
+        """
+        spec = dict(self.default)
+        spec.update(self.methods.get(method, {}))
+        with self._lock:
+            if self.random.random() < spec.get("timeout_rate", 0.0):
+                return self.timeout_ms / 1000.0, MockTimeout
+            delay = self._latency(spec.get("latency", {}))
+            if self.random.random() < spec.get("failure_rate", 0.0):
+                return delay, MockFailure
+        return delay, None
+
+    def simulate(self, method):
+        delay, error = self.plan(method)
+        if delay:
+            time.sleep(delay)
+        if error:
+            raise error("Simulated %s of '%s'" % (
+                "timeout" if error is MockTimeout else "failure", method
+            ))
+
+
+def _simulated(func):
+    """ Applies the configured latency and failures to the mocked method """
+
+    @wraps(func)
+    def inner(self, *args, **kwargs):
+        self.behavior.simulate(func.__name__)
+        return func(self, *args, **kwargs)
+
+    return inner
+
+
 class MockDataCollectHandler(Handler, BaseMockHandler):
-    agreed = False
-    log_credentials = False
-    minipots = {
+    DEFAULT_MINIPOTS = {
         "23tcp": False,
         "2323tcp": False,
         "80tcp": False,
@@ -40,20 +173,34 @@ class MockDataCollectHandler(Handler, BaseMockHandler):
         "8080tcp": False,
     }
 
+    def __init__(self, *args, **kwargs):
+        super(MockDataCollectHandler, self).__init__(*args, **kwargs)
+        self.behavior = MockBehavior()
+        self.random = self.behavior.random
+        self.agreed = None  # not stored yet, any set is applied
+        self.log_credentials = False
+        self.minipots = dict(self.DEFAULT_MINIPOTS)
+        self._lock = threading.Lock()
+
     @logger_wrapper(logger)
-    def get_registered(self, email, language):
+    @_simulated
+    def get_registered(self, email, language, notify=None, timeout=None):
         """ Mocks registration info
 
         :param email: email which was used during the registration
         :type email: str
         :param language: language which will be used in the server query (iso2)
         :type language: str
+        :param notify: function which sends a notification about the changed status
+        :type notify: callable
+        :param timeout: max time to obtain the status in seconds
+        :type timeout: float
 
         :returns: Mocked result
         :rtype: dict
         """
-        registration_code = "%016X" % random.randrange(0x10000000000000000)
-        return random.choice([
+        registration_code = "%016X" % self.random.randrange(0x10000000000000000)
+        return self.random.choice([
             {
                 "status": "free",
                 "url": "https://some.page/%s/data?email=%s&registration_code=%s" %
@@ -78,14 +225,16 @@ class MockDataCollectHandler(Handler, BaseMockHandler):
         ])
 
     @logger_wrapper(logger)
+    @_simulated
     def get_agreed(self):
         """ Mock getting information whether the user agreed with data collect
         :returns: True if user agreed, False otherwise
         :rtype: boolean
         """
-        return self.agreed
+        return bool(self.agreed)
 
     @logger_wrapper(logger)
+    @_simulated
     def get_sending_info(self):
         """ Returns fake sending status
 
@@ -94,40 +243,181 @@ class MockDataCollectHandler(Handler, BaseMockHandler):
         """
         choices = ["online", "offline", "unknown"]
         return {
-            "firewall_status": {"state": random.choice(choices), "last_check": 1501857960},
-            "ucollect_status": {"state": random.choice(choices), "last_check": 1501857970},
+            "firewall_status": {"state": self.random.choice(choices), "last_check": 1501857960},
+            "ucollect_status": {"state": self.random.choice(choices), "last_check": 1501857970},
         }
 
+    def _set_agreed(self, agreed):
+        with self._lock:
+            applied = self.agreed != agreed
+            self.agreed = agreed
+        return {"result": True, "applied": applied}
 
     @logger_wrapper(logger)
+    @_simulated
     def set_agreed(self, agreed):
         """ Mock setting information whether the user agreed with data collect
-        :returns: True
-        :rtype: boolean
+        :returns: {"result": True, "applied": True/False}
+        :rtype: dict
         """
-        self.agreed = agreed
-        return True
+        return self._set_agreed(agreed)
 
     @logger_wrapper(logger)
+    @_simulated
+    def set_agreed_async(self, agreed, exit_notify):
+        """ Mock setting information whether the user agreed with data collect in the background
+        :param exit_notify: function which is called with the result
+        :type exit_notify: callable
+        :returns: {"result": True, "applied": True/False, "job_id": "..."}
+        :rtype: dict
+        """
+        res = self._set_agreed(agreed)
+        res["job_id"] = uuid.uuid4().hex
+
+        thread = threading.Timer(
+            0.1, exit_notify, ({"job_id": res["job_id"], "agreed": agreed, "result": True},)
+        )
+        thread.daemon = True
+        thread.start()
+
+        return res
+
+    @logger_wrapper(logger)
+    @_simulated
     def get_honeypots(self):
         """ Mock getting configuration of the honeypots
         :returns: {"minipots": {...}, "log_credentials": True/False}
         :rtype: dict
         """
-        return {
-            "minipots": self.minipots,
-            "log_credentials": self.log_credentials,
-        }
+        with self._lock:
+            return {
+                "minipots": dict(self.minipots),
+                "log_credentials": self.log_credentials,
+            }
 
     @logger_wrapper(logger)
+    @_simulated
     def set_honeypots(self, honepot_settings):
         """ Mock setting configuration of the honeypots
         :param honepot_settings: {"minipots": {...}, "log_credentials": True/False}
         :type honepot_settings: dict
 
-        :returns: True
-        :rtype: boolean
+        :returns: {"result": True, "applied": True/False}
+        :rtype: dict
         """
-        self.log_credentials = honepot_settings["log_credentials"]
-        self.minipots = honepot_settings["minipots"]
-        return True
+        with self._lock:
+            applied = (
+                self.log_credentials != honepot_settings["log_credentials"]
+                or self.minipots != honepot_settings["minipots"]
+            )
+            self.log_credentials = honepot_settings["log_credentials"]
+            self.minipots = dict(honepot_settings["minipots"])
+        return {"result": True, "applied": applied}
+
+    @logger_wrapper(logger)
+    def watch_sending_status(self, notify):
+        """ Mock watching of the sending status (no changes are reported)
+
+        :param notify: function which is called with sending info when any state changes
+        :type notify: callable
+        """
+
+    @logger_wrapper(logger)
+    def start_sending_sampler(self):
+        """ Mock starting to record history of the sending status
+        """
+
+    @logger_wrapper(logger)
+    @_simulated
+    def get_sending_history(self, since=None, until=None):
+        """ Returns fake history of the sending status
+
+        :param since: only records with timestamp >= since
+        :type since: float
+        :param until: only records with timestamp <= until
+        :type until: float
+        :returns: {"interval": ..., "capacity": ..., "records": [...]}
+        :rtype: dict
+        """
+        choices = ["online", "offline", "unknown"]
+        records = [
+            {
+                "timestamp": 1501857960 + i * 60,
+                "firewall": self.random.choice(choices),
+                "ucollect": self.random.choice(choices),
+            }
+            for i in range(10)
+        ]
+        return {
+            "interval": 60,
+            "capacity": 10080,
+            "records": [
+                e for e in records
+                if (since is None or e["timestamp"] >= since)
+                and (until is None or e["timestamp"] <= until)
+            ],
+        }
+
+    @logger_wrapper(logger)
+    @_simulated
+    def get_sending_stats(self):
+        """ Returns fake availability statistics of firewall and ucollect uplinks
+
+        :returns: {"firewall": {"1h": {...}, "24h": {...}, "7d": {...}}, "ucollect": {...}}
+        :rtype: dict
+        """
+        return {
+            channel: {
+                window: {
+                    "online_percent": round(self.random.uniform(90, 100), 3),
+                    "transitions": self.random.randrange(5),
+                    "longest_outage": self.random.choice([0, 60, 120, 600]),
+                }
+                for window in ["1h", "24h", "7d"]
+            }
+            for channel in ["firewall", "ucollect"]
+        }
+
+    @logger_wrapper(logger)
+    def get_metrics(self):
+        """ Returns fake call counts and latencies
+
+        :returns: {"buckets_ms": [...], "handlers": {...}, "subprocesses": {...}, "locks": {...}}
+        :rtype: dict
+        """
+        buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+        def metric():
+            histogram = [self.random.randrange(10) for _ in range(len(buckets) + 1)]
+            return {
+                "count": sum(histogram),
+                "errors": self.random.randrange(2),
+                "total_ms": float(sum(histogram) * 10),
+                "max_ms": 100.0,
+                "histogram": histogram,
+            }
+
+        return {
+            "buckets_ms": buckets,
+            "handlers": {"get_agreed": metric(), "get_sending_info": metric()},
+            "subprocesses": {"registered.sh": metric()},
+            "locks": {"sending_files.file_lock": metric()},
+        }
+
+    @logger_wrapper(logger)
+    @_simulated
+    def get_registration_server_status(self):
+        """ Returns fake state of the registration server circuit breaker
+
+        :returns: {"state": ..., "failures": ..., "opened_at": ..., "retry_in": ...}
+        :rtype: dict
+        """
+        state = self.random.choice(["closed", "closed", "open", "half_open"])
+        if state == "closed":
+            return {"state": state, "failures": 0, "opened_at": None, "retry_in": None}
+        return {
+            "state": state,
+            "failures": self.random.randrange(3, 10),
+            "opened_at": 1501857960.0,
+            "retry_in": round(self.random.uniform(0, 60), 3) if state == "open" else 0.0,
+        }
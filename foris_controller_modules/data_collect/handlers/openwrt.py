@@ -18,13 +18,17 @@
 #
 
 import logging
+import os
+import threading
+import time
 
 from foris_controller.handler_base import BaseOpenwrtHandler
 from foris_controller.utils import logger_wrapper
 
 from foris_controller_backends.data_collect import (
-    RegisteredCmds, DataCollectUci, SendingFiles,
+    RegisteredCmds, DataCollectUci, SendingFiles, SendingStatusWatcher, SendingSampler,
 )
+from foris_controller_backends.data_collect.metrics import metrics
 
 from .. import Handler
 
@@ -33,24 +37,63 @@ logger = logging.getLogger(__name__)
 
 class OpenwrtDataCollectHandler(Handler, BaseOpenwrtHandler):
 
-    sending_files = SendingFiles()
-    registered_cmds = RegisteredCmds()
-    uci = DataCollectUci()
+    # backend objects are shared and created on the first use
+    _backends = {}
+    _backends_lock = threading.Lock()
+    sending_watcher = None
+    sending_sampler = None
+    _sending_sampler_lock = threading.Lock()
+
+    @classmethod
+    def _get_backend(cls, backend_class):
+        with cls._backends_lock:
+            if backend_class not in cls._backends:
+                cls._backends[backend_class] = backend_class()
+            return cls._backends[backend_class]
+
+    @property
+    def sending_files(self):
+        return self._get_backend(SendingFiles)
+
+    @property
+    def registered_cmds(self):
+        return self._get_backend(RegisteredCmds)
+
+    @property
+    def uci(self):
+        return self._get_backend(DataCollectUci)
 
     @logger_wrapper(logger)
-    def get_registered(self, email, language):
+    @metrics.timed("handlers")
+    def get_registered(self, email, language, notify=None, timeout=None):
         """ Tries to obtain info whether the user was registered
 
+        Last known result is returned right away (marked as stale) when the cached one expires.
+        It is refreshed in the background and `notify` is called when the status changes.
+
         :param email: email which will be used during the server query
         :type email: str
         :param language: language which will be used during the server query
         :type language: str
+        :param notify: function which sends a notification about the changed status
+        :type notify: callable
+        :param timeout: max time to obtain the status in seconds (module default if None)
+        :type timeout: float
         :returns: result
         :rtype: dict
         """
-        return OpenwrtDataCollectHandler.registered_cmds.get_registered(email, language)
+
+        def on_change(result):
+            msg = {"email": email, "language": language}
+            msg.update(result)
+            notify(msg)
+
+        return self.registered_cmds.get_registered(
+            email, language, on_change if notify else None, timeout
+        )
 
     @logger_wrapper(logger)
+    @metrics.timed("handlers")
     def get_agreed(self):
         """ Get information whether the user agreed with data collect
         :returns: True if user agreed, False otherwise
@@ -59,16 +102,33 @@ class OpenwrtDataCollectHandler(Handler, BaseOpenwrtHandler):
         return self.uci.get_agreed()
 
     @logger_wrapper(logger)
+    @metrics.timed("handlers")
     def set_agreed(self, agreed):
-        """ Mock setting information whether the user agreed with data collect
+        """ Set information whether the user agreed with data collect
         :param agreed: user agreed with data collect (True/False)
         :type agreed: boolean
-        :returns: True
-        :rtype: boolean
+        :returns: {"result": True, "applied": True/False}
+        :rtype: dict
+        """
+        return {"result": True, "applied": self.uci.set_agreed(agreed)}
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def set_agreed_async(self, agreed, exit_notify):
+        """ Set information whether the user agreed with data collect,
+            ucollect service is updated in the background
+        :param agreed: user agreed with data collect (True/False)
+        :type agreed: boolean
+        :param exit_notify: function which is called with the result when the service is updated
+        :type exit_notify: callable
+        :returns: {"result": True, "applied": True/False, "job_id": "..."}
+        :rtype: dict
         """
-        return self.uci.set_agreed(agreed)
+        applied, job_id = self.uci.set_agreed_async(agreed, exit_notify)
+        return {"result": True, "applied": applied, "job_id": job_id}
 
     @logger_wrapper(logger)
+    @metrics.timed("handlers")
     def get_honeypots(self):
         """ Get configuration of the honeypots
         :returns: {"minipots": {...}, "log_credentials": True/False}
@@ -77,17 +137,19 @@ class OpenwrtDataCollectHandler(Handler, BaseOpenwrtHandler):
         return self.uci.get_honeypots()
 
     @logger_wrapper(logger)
+    @metrics.timed("handlers")
     def set_honeypots(self, honepot_settings):
         """ Set configuration of the honeypots
         :param honepot_settings: {"minipots": {...}, "log_credentials": True/False}
         :type honepot_settings: dict
 
-        :returns: True
-        :rtype: boolean
+        :returns: {"result": True, "applied": True/False}
+        :rtype: dict
         """
-        return self.uci.set_honeypots(honepot_settings)
+        return {"result": True, "applied": self.uci.set_honeypots(honepot_settings)}
 
     @logger_wrapper(logger)
+    @metrics.timed("handlers")
     def get_sending_info(self):
         """ Obtains info whether the router is sending data to our servers
 
@@ -95,3 +157,91 @@ class OpenwrtDataCollectHandler(Handler, BaseOpenwrtHandler):
         :rtype: dict
         """
         return self.sending_files.get_sending_info()
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def watch_sending_status(self, notify):
+        """ Starts to watch the sending status and report its changes
+
+        :param notify: function which is called with sending info when any state changes
+        :type notify: callable
+        """
+        if OpenwrtDataCollectHandler.sending_watcher is None:
+            watcher = SendingStatusWatcher(notify, self.sending_files)
+            watcher.start()
+            OpenwrtDataCollectHandler.sending_watcher = watcher
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def start_sending_sampler(self):
+        """ Starts to record history of the sending status (if it is not running yet)
+
+        :returns: running sampler
+        :rtype: SendingSampler
+        """
+        with OpenwrtDataCollectHandler._sending_sampler_lock:
+            if OpenwrtDataCollectHandler.sending_sampler is None:
+                sampler = SendingSampler(self.sending_files)
+                prometheus_path = os.environ.get("FORIS_DATA_COLLECT_PROMETHEUS_PATH")
+                if prometheus_path:
+                    from foris_controller_backends.data_collect.exporter import (
+                        PrometheusExporter
+                    )
+
+                    sampler.listeners.append(
+                        PrometheusExporter(prometheus_path, self.sending_files, self.uci)
+                    )
+                sampler.start()
+                OpenwrtDataCollectHandler.sending_sampler = sampler
+            return OpenwrtDataCollectHandler.sending_sampler
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def get_sending_history(self, since=None, until=None):
+        """ Get recorded history of the sending status
+
+        :param since: only records with timestamp >= since
+        :type since: float
+        :param until: only records with timestamp <= until
+        :type until: float
+        :returns: {"interval": ..., "capacity": ..., "records": [...]}
+        :rtype: dict
+        """
+        sampler = self.start_sending_sampler()
+        return {
+            "interval": sampler.interval,
+            "capacity": sampler.history.capacity,
+            "records": [
+                {"timestamp": timestamp, "firewall": firewall, "ucollect": ucollect}
+                for timestamp, firewall, ucollect in sampler.history.records(since, until)
+            ],
+        }
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def get_sending_stats(self):
+        """ Get availability statistics of firewall and ucollect uplinks
+
+        :returns: {"firewall": {"1h": {...}, "24h": {...}, "7d": {...}}, "ucollect": {...}}
+        :rtype: dict
+        """
+        return self.start_sending_sampler().stats.summary(time.time())
+
+    @logger_wrapper(logger)
+    def get_metrics(self):
+        """ Get call counts and latencies of handler methods, subprocesses and locks
+
+        :returns: {"buckets_ms": [...], "handlers": {...}, "subprocesses": {...}, "locks": {...}}
+        :rtype: dict
+        """
+        return metrics.snapshot()
+
+    @logger_wrapper(logger)
+    @metrics.timed("handlers")
+    def get_registration_server_status(self):
+        """ Get state of the registration server circuit breaker
+
+        :returns: {"state": ..., "failures": ..., "opened_at": ..., "retry_in": ...}
+        :rtype: dict
+        """
+        return self.registered_cmds.get_server_status()
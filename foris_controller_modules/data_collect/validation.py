@@ -0,0 +1,149 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Fast validation of data_collect messages
+
+The module schema is a large `oneOf` so a validator has to try every branch.
+DataCollectValidator precompiles a validator for each (kind, action) pair and
+dispatches on these fields. It accepts and rejects the same messages as the
+full schema.
+"""
+
+import glob
+import json
+import logging
+import os
+
+import jsonschema
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema", "data_collect.json")
+DEFINITIONS_PREFIX = "#/definitions/"
+
+
+def _references(schema):
+    """ Yields names of definitions referenced within the schema """
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key == "$ref" and isinstance(value, str) and value.startswith(DEFINITIONS_PREFIX):
+                yield value[len(DEFINITIONS_PREFIX):]
+            else:
+                for name in _references(value):
+                    yield name
+    elif isinstance(schema, list):
+        for item in schema:
+            for name in _references(item):
+                yield name
+
+
+def base_definitions():
+    """ Loads definitions shared by all foris-controller schemas (e.g. locale_name)
+
+    :returns: definitions or {} when foris-controller schemas are not found
+    :rtype: dict
+    """
+    try:
+        import foris_controller
+    except ImportError:
+        return {}
+
+    definitions = {}
+    pattern = os.path.join(os.path.dirname(foris_controller.__file__), "schemas", "*.json")
+    for path in sorted(glob.glob(pattern)):
+        try:
+            with open(path) as f:
+                definitions.update(json.load(f).get("definitions", {}))
+        except (IOError, ValueError, AttributeError):
+            logger.debug("Failed to load definitions from '%s'." % path)
+    return definitions
+
+
+class DataCollectValidator(object):
+    """ Validator of data_collect messages with dispatching on (kind, action) """
+
+    def __init__(self, definitions=None, schema_path=SCHEMA_PATH):
+        """
+        :param definitions: definitions referenced by the schema which are not part of it
+                            (loaded from foris-controller by default)
+        :type definitions: dict
+        :param schema_path: path to the module schema
+        :type schema_path: str
+        :raises: ValueError when a referenced definition is missing
+        """
+        with open(schema_path) as f:
+            schema = json.load(f)
+
+        all_definitions = base_definitions() if definitions is None else dict(definitions)
+        all_definitions.update(schema.get("definitions", {}))
+
+        # fail here rather than in the first is_valid() which reaches the reference
+        missing = set(_references([all_definitions, schema["oneOf"]])) - set(all_definitions)
+        if missing:
+            raise ValueError("Unresolved schema definitions: %s" % ", ".join(sorted(missing)))
+
+        self.full = jsonschema.Draft4Validator(
+            {"definitions": all_definitions, "oneOf": schema["oneOf"]}
+        )
+
+        self._validators = {}
+        for branch in schema["oneOf"]:
+            compiled = jsonschema.Draft4Validator(dict(branch, definitions=all_definitions))
+            properties = branch["properties"]
+            for kind in properties["kind"]["enum"]:
+                for action in properties["action"]["enum"]:
+                    self._validators.setdefault((kind, action), []).append(compiled)
+
+    def _dispatch(self, message):
+        """ Returns validators of branches the message can match
+            or None if the full schema has to be used
+        """
+        if not isinstance(message, dict):
+            return None
+        kind, action = message.get("kind"), message.get("action")
+        if not isinstance(kind, str) or not isinstance(action, str):
+            # branches don't require these fields
+            return None
+        return self._validators.get((kind, action), [])
+
+    def is_valid(self, message):
+        """ Checks the message
+
+        :param message: message to be checked
+        :type message: dict
+        :returns: same result as validation against the full schema
+        :rtype: bool
+        """
+        validators = self._dispatch(message)
+        if validators is None:
+            return self.full.is_valid(message)
+        # oneOf => exactly one branch has to match
+        return sum(1 for e in validators if e.is_valid(message)) == 1
+
+    def validate(self, message):
+        """ Validates the message
+
+        :param message: message to be validated
+        :type message: dict
+        :raises: jsonschema.ValidationError
+        """
+        if not self.is_valid(message):
+            # let the full schema produce the detailed error
+            self.full.validate(message)
+            raise jsonschema.ValidationError("%r is not valid under the schema" % (message, ))
@@ -64,6 +64,14 @@ setup(
         "git+https://gitlab.nic.cz/turris/foris-controller/foris-controller-testtools.git#egg=foris-controller-testtools",
         "git+https://gitlab.nic.cz/turris/foris-controller/foris-client.git#egg=foris-client",
     ],
+    extras_require={
+        'loadgen': ['foris-client'],
+    },
+    entry_points={
+        'console_scripts': [
+            'foris-data-collect-loadgen = foris_controller_data_collect_module.loadgen:main',
+        ],
+    },
     include_package_data=True,
     zip_safe=False,
 )
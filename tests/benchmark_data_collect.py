@@ -0,0 +1,159 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Benchmark of data_collect actions going through the controller
+
+Not collected by default, run it explicitly e.g.:
+
+    python -m pytest tests/benchmark_data_collect.py -s \\
+        --backend openwrt --backend mock --message-bus unix-socket \\
+        --benchmark-iterations 200 --benchmark-output bench.json
+
+Each line of the output file is a json object:
+    {"name": ..., "params": {"backend": ..., "bus": ..., ...}, "stats": {"p50_ms": ..., ...}}
+"""
+
+import pytest
+import time
+
+from .conftest import (
+    benchmark_report, cmdline_script_root, registered_script, registration_code,
+    summarize_latencies,
+)
+from foris_controller_testtools.fixtures import (
+    infrastructure,
+    uci_configs_init,
+    start_buses,
+    mosquitto_test,
+    ubusd_test,
+    init_script_result,
+    FILE_ROOT_PATH,
+)
+from foris_controller_testtools.utils import FileFaker
+
+MINIPOTS = ["23tcp", "2323tcp", "80tcp", "3128tcp", "8123tcp", "8080tcp"]
+
+
+@pytest.fixture(scope="function")
+def status_files():
+    with FileFaker(
+        FILE_ROOT_PATH,
+        "/tmp/firewall-turris-status.txt",
+        False,
+        "turris firewall working: yes\nlast working timestamp: 1501857960\n",
+    ) as fw, FileFaker(FILE_ROOT_PATH, "/tmp/ucollect-status", False, "online 1501857970") as uc:
+        yield fw, uc
+
+
+@pytest.fixture(params=[0, 0.1], ids=["no_delay", "delay_100ms"], scope="function")
+def register_cmd(request, cmdline_script_root):
+    with FileFaker(
+        cmdline_script_root,
+        "/usr/share/server-uplink/registered.sh",
+        True,
+        registered_script("owned", delay=request.param),
+    ):
+        yield request.param
+
+
+def run_benchmark(request, infrastructure, benchmark_report, name, make_message, **params):
+    iterations = request.config.option.benchmark_iterations
+    latencies = []
+    errors = 0
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        message = make_message(i)
+        before = time.perf_counter()
+        res = infrastructure.process_message(message)
+        latencies.append(time.perf_counter() - before)
+        if "errors" in res:
+            errors += 1
+    elapsed = time.perf_counter() - start
+
+    stats = summarize_latencies(latencies, elapsed)
+    stats["errors"] = errors
+    benchmark_report(
+        name,
+        stats,
+        backend=request.node.callspec.params.get("backend_param"),
+        bus=request.node.callspec.params.get("message_bus_param"),
+        **params
+    )
+    assert errors == 0
+
+
+def test_get(request, uci_configs_init, status_files, infrastructure, start_buses, benchmark_report):
+    run_benchmark(
+        request, infrastructure, benchmark_report, "data_collect.get",
+        lambda i: {"module": "data_collect", "action": "get", "kind": "request"},
+    )
+
+
+def test_set(
+    request, uci_configs_init, init_script_result, infrastructure, start_buses, benchmark_report
+):
+    run_benchmark(
+        request, infrastructure, benchmark_report, "data_collect.set",
+        lambda i: {
+            "module": "data_collect", "action": "set", "kind": "request",
+            "data": {"agreed": bool(i % 2)},
+        },
+    )
+
+
+def test_get_honeypots(request, uci_configs_init, infrastructure, start_buses, benchmark_report):
+    run_benchmark(
+        request, infrastructure, benchmark_report, "data_collect.get_honeypots",
+        lambda i: {"module": "data_collect", "action": "get_honeypots", "kind": "request"},
+    )
+
+
+def test_set_honeypots(
+    request, uci_configs_init, init_script_result, infrastructure, start_buses, benchmark_report
+):
+    run_benchmark(
+        request, infrastructure, benchmark_report, "data_collect.set_honeypots",
+        lambda i: {
+            "module": "data_collect", "action": "set_honeypots", "kind": "request",
+            "data": {
+                "minipots": {e: bool(i % 2) for e in MINIPOTS},
+                "log_credentials": bool(i % 2),
+            },
+        },
+    )
+
+
+def test_get_registered(
+    request,
+    uci_configs_init,
+    registration_code,
+    register_cmd,
+    infrastructure,
+    start_buses,
+    benchmark_report,
+):
+    run_benchmark(
+        request, infrastructure, benchmark_report, "data_collect.get_registered",
+        lambda i: {
+            "module": "data_collect", "action": "get_registered", "kind": "request",
+            "data": {"email": "test@test.test", "language": "en"},
+        },
+        registered_delay=register_cmd,
+    )
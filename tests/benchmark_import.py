@@ -0,0 +1,82 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Import and startup time of the data_collect module
+
+Not collected by default, run it explicitly:
+
+    python -m pytest tests/benchmark_import.py -s [--benchmark-output=bench.json]
+"""
+
+import re
+import subprocess
+import sys
+
+from .conftest import benchmark_report, summarize_latencies
+
+MODULES = [
+    "foris_controller_modules.data_collect",
+    "foris_controller_modules.data_collect.handlers.openwrt",
+    "foris_controller_backends.data_collect",
+]
+
+# what the controller does on startup
+STARTUP = """
+import time
+start = time.perf_counter()
+from foris_controller_modules.data_collect import DataCollectModule
+from foris_controller_modules.data_collect.handlers import OpenwrtDataCollectHandler
+DataCollectModule(lambda msg: None, OpenwrtDataCollectHandler())
+print(time.perf_counter() - start)
+"""
+
+RUNS = 10
+
+
+def import_times():
+    """ Returns cumulative import times (seconds) of MODULES measured by -X importtime """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % MODULES[1]],
+        stderr=subprocess.PIPE, check=True,
+    ).stderr.decode()
+    result = {}
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S.*)$", line)
+        if match and match.group(3).strip() in MODULES:
+            result[match.group(3).strip()] = int(match.group(2)) / 1000000.0
+    return result
+
+
+def test_import_time(benchmark_report):
+    samples = {name: [] for name in MODULES}
+    for _ in range(RUNS):
+        for name, seconds in import_times().items():
+            samples[name].append(seconds)
+
+    for name, latencies in samples.items():
+        assert latencies, "%s was not imported" % name
+        benchmark_report("import_time", summarize_latencies(latencies), module=name)
+
+
+def test_startup_time(benchmark_report):
+    latencies = [
+        float(subprocess.check_output([sys.executable, "-c", STARTUP]).decode())
+        for _ in range(RUNS)
+    ]
+    benchmark_report("startup_time", summarize_latencies(latencies), handler="openwrt")
@@ -0,0 +1,64 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Benchmark of SendingFiles.get_sending_info
+
+Not collected by default, run it explicitly:
+
+    python -m pytest tests/benchmark_sending_files.py -s [--benchmark-output=bench.json]
+"""
+
+import time
+
+from .conftest import cmdline_script_root, data_collect_backend, benchmark_report
+from .conftest import summarize_latencies
+from foris_controller_testtools.fixtures import FILE_ROOT_PATH
+from foris_controller_testtools.utils import FileFaker
+
+ITERATIONS = 2000
+
+
+def test_get_sending_info_cold_warm(data_collect_backend, benchmark_report):
+    files = data_collect_backend.SendingFiles()
+
+    with FileFaker(
+        FILE_ROOT_PATH,
+        files.FW_PATH,
+        False,
+        "turris firewall working: yes\nlast working timestamp: 1501857960\n",
+    ), FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "online 1501857970"):
+        cold = []
+        for _ in range(ITERATIONS):
+            files._parsed.clear()
+            start = time.perf_counter()
+            files.get_sending_info()
+            cold.append(time.perf_counter() - start)
+
+        warm = []
+        for _ in range(ITERATIONS):
+            start = time.perf_counter()
+            files.get_sending_info()
+            warm.append(time.perf_counter() - start)
+
+    cold_stats = summarize_latencies(cold)
+    warm_stats = summarize_latencies(warm)
+    benchmark_report("sending_files.get_sending_info", cold_stats, path="cold")
+    benchmark_report("sending_files.get_sending_info", warm_stats, path="warm")
+
+    assert warm_stats["p50_ms"] < cold_stats["p50_ms"]
@@ -0,0 +1,53 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Benchmark of data_collect message validation (full oneOf schema vs dispatching)
+
+Not collected by default, run it explicitly:
+
+    python -m pytest tests/benchmark_validation.py -s [--benchmark-output=bench.json]
+"""
+
+import time
+
+from .conftest import benchmark_report, summarize_latencies
+from .test_data_collect_validation import VALID, INVALID, validator
+
+ITERATIONS = 200
+
+
+def _measure(is_valid, messages):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for message in messages:
+            begin = time.perf_counter()
+            is_valid(message)
+            latencies.append(time.perf_counter() - begin)
+    return summarize_latencies(latencies, time.perf_counter() - start)
+
+
+def test_validation_full_vs_dispatch(validator, benchmark_report):
+    for name, messages in [("valid", VALID), ("invalid", INVALID)]:
+        full = _measure(validator.full.is_valid, messages)
+        dispatch = _measure(validator.is_valid, messages)
+        benchmark_report("validation", full, messages=name, validator="full")
+        benchmark_report("validation", dispatch, messages=name, validator="dispatch")
+
+        assert dispatch["p50_ms"] < full["p50_ms"]
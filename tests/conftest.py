@@ -17,8 +17,11 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 #
 
+import json
 import pytest
 import os
+import textwrap
+import threading
 
 # load common fixtures
 from foris_controller_testtools.fixtures import (
@@ -29,7 +32,11 @@ from foris_controller_testtools.fixtures import (
     extra_module_paths,
     message_bus,
     backend,
+    FILE_ROOT_PATH,
 )
+from foris_controller_testtools.utils import FileFaker
+
+REGISTRATION_CODE = "0000000B00009CD6"
 
 
 @pytest.fixture(scope="session")
@@ -47,6 +54,119 @@ def controller_modules():
     return ["data_collect"]
 
 
+@pytest.fixture(scope="module")
+def env_overrides():
+    # most of the tests expect that each request hits the backend
+    return {
+        "FORIS_DATA_COLLECT_REGISTERED_TTL": "0",
+        "FORIS_DATA_COLLECT_REGISTERED_TRANSIENT_TTL": "0",
+        "FORIS_DATA_COLLECT_REGISTERED_STALE_TTL": "0",
+        "FORIS_DATA_COLLECT_RESTART_DELAY": "0",
+        "FORIS_DATA_COLLECT_BREAKER_THRESHOLD": "0",
+        "FORIS_DATA_COLLECT_REGISTERED_CACHE_PATH": "",
+    }
+
+
+@pytest.fixture(scope="function")
+def registration_code():
+    with FileFaker(
+        FILE_ROOT_PATH, "/usr/share/server-uplink/registration_code", False, REGISTRATION_CODE
+    ) as f:
+        yield f, REGISTRATION_CODE
+
+
+def registered_script(status, code=200, delay=0, log="/dev/null"):
+    """ Returns content of registered.sh which prints the given answer of the server
+
+    :param status: registration status (owned, free, ...)
+    :param code: http code of the answer
+    :param delay: how long to sleep before printing the answer (seconds)
+    :param log: file where the arguments of each run are appended
+    """
+    return textwrap.dedent(
+        """\
+        #!/bin/sh
+        echo "$@" >> %(log)s
+        sleep %(delay)s
+        cat <<-EOF
+        status: %(status)s
+        url: "https://some.page/${2:-en}/data?email=${1}&registration_code=XXXXXXX"
+        code: %(code)d
+        EOF
+        """
+        % dict(status=status, code=code, delay=delay, log=log)
+    )
+
+
+@pytest.fixture(scope="session")
+def data_collect_backend(cmdline_script_root):
+    """ Openwrt backend module imported into the test process """
+    env = {
+        "FORIS_CMDLINE_ROOT": cmdline_script_root,
+        "FORIS_FILE_ROOT": FILE_ROOT_PATH,
+        # tests shouldn't share cached registration results
+        "FORIS_DATA_COLLECT_REGISTERED_CACHE_PATH": "",
+    }
+    original = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+
+    from foris_controller.app import app_info
+    app_info.setdefault("lock_backend", threading)
+
+    import foris_controller_backends.data_collect as backend
+
+    yield backend
+
+    for key, value in original.items():
+        if value is None:
+            del os.environ[key]
+        else:
+            os.environ[key] = value
+
+
+def summarize_latencies(latencies, elapsed=None):
+    """ Computes statistics of measured latencies (in seconds)
+
+    :param latencies: measured latencies
+    :type latencies: list
+    :param elapsed: wall time of the whole run (sum of latencies if not set)
+    :type elapsed: float
+    :returns: count, percentiles in milliseconds and requests per second
+    :rtype: dict
+    """
+    ordered = sorted(latencies)
+    elapsed = elapsed if elapsed is not None else sum(ordered)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "rps": len(ordered) / elapsed if elapsed else 0.0,
+    }
+
+
+@pytest.fixture(scope="session")
+def benchmark_report(request):
+    """ Returns a function which stores benchmark results
+
+    Results are printed and appended as json lines to the file set by --benchmark-output.
+    """
+    path = request.config.option.benchmark_output
+
+    def report(name, stats, **params):
+        record = {"name": name, "params": params, "stats": stats}
+        print(json.dumps(record, sort_keys=True))
+        if path:
+            with open(path, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    return report
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--backend",
@@ -60,6 +180,17 @@ def pytest_addoption(parser):
         default=[],
         help=("Set test bus here. available values = (unix-socket, ubus, mqtt)"),
     )
+    parser.addoption(
+        "--benchmark-output",
+        default=None,
+        help=("Append benchmark results (json lines) to this file"),
+    )
+    parser.addoption(
+        "--benchmark-iterations",
+        type=int,
+        default=100,
+        help=("Number of requests sent by each benchmark"),
+    )
     parser.addoption(
         "--debug-output",
         action="store_true",
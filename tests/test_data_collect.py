@@ -17,10 +17,10 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 #
 
+import os
 import pytest
-import textwrap
 
-from .conftest import cmdline_script_root
+from .conftest import cmdline_script_root, registered_script, registration_code
 from foris_controller_testtools.fixtures import (
     infrastructure,
     uci_configs_init,
@@ -29,7 +29,6 @@ from foris_controller_testtools.fixtures import (
     ubusd_test,
     init_script_result,
     only_backends,
-    FILE_ROOT_PATH,
     UCI_CONFIG_DIR_PATH,
 )
 from foris_controller_testtools.utils import check_service_result, get_uci_module, FileFaker
@@ -44,43 +43,16 @@ def register_cmd(request, cmdline_script_root):
     status_code, status = request.param
 
     if not status_code:
-        content = """\
-            #!/bin/sh
-            exit 1
-        """
+        content = "#!/bin/sh\nexit 1\n"
     else:
-        content = """\
-            #!/bin/sh
-            cat <<-EOF
-            status: %(status)s
-            url: "https://some.page/${2:-en}/data?email=${1}&registration_code=XXXXXXX"
-            code: %(code)d
-            EOF
-        """ % dict(
-            code=status_code, status=status
-        )
+        content = registered_script(status, status_code)
 
     with FileFaker(
-        cmdline_script_root,
-        "/usr/share/server-uplink/registered.sh",
-        True,
-        textwrap.dedent(content),
+        cmdline_script_root, "/usr/share/server-uplink/registered.sh", True, content
     ) as f:
         yield f, status
 
 
-@pytest.fixture(scope="function")
-def registration_code(request):
-    content = "0000000B00009CD6"
-    with FileFaker(
-        FILE_ROOT_PATH,
-        "/usr/share/server-uplink/registration_code",
-        False,
-        textwrap.dedent(content),
-    ) as f:
-        yield f, content
-
-
 @pytest.mark.parametrize("code", ["cs", "nb_NO"])
 def test_get_registered(code, uci_configs_init, infrastructure, start_buses):
     res = infrastructure.process_message(
@@ -119,6 +91,27 @@ def test_get_registered_openwrt(
     assert status not in ["free", "foreign"] or "url" in res["data"]
 
 
+@pytest.mark.only_backends(["openwrt"])
+def test_get_registered_timeout(
+    cmdline_script_root, uci_configs_init, infrastructure, start_buses, registration_code
+):
+    with FileFaker(
+        cmdline_script_root,
+        "/usr/share/server-uplink/registered.sh",
+        True,
+        "#!/bin/sh\nsleep 10\n",
+    ):
+        res = infrastructure.process_message(
+            {
+                "module": "data_collect",
+                "action": "get_registered",
+                "kind": "request",
+                "data": {"email": "test@test.test", "language": "en", "timeout": 0.5},
+            }
+        )
+    assert res["data"] == {"status": "unknown", "reason": "timeout"}
+
+
 def test_get_registered_errors(uci_configs_init, infrastructure, start_buses):
     res = infrastructure.process_message(
         {"module": "data_collect", "action": "get_registered", "kind": "request"}
@@ -133,6 +126,25 @@ def test_get_registered_errors(uci_configs_init, infrastructure, start_buses):
     assert "errors" in res
     assert "Incorrect input." in res["errors"][0]["description"]
 
+    res = infrastructure.process_message(
+        {
+            "module": "data_collect",
+            "action": "get_registered",
+            "kind": "request",
+            "data": {"email": "test@test.test", "language": "en", "timeout": 0},
+        }
+    )
+    assert "errors" in res
+    assert "Incorrect input." in res["errors"][0]["description"]
+
+
+def test_get_registration_server_status(uci_configs_init, infrastructure, start_buses):
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "get_registration_server_status", "kind": "request"}
+    )
+    assert set(res["data"]) == {"state", "failures", "opened_at", "retry_in"}
+    assert res["data"]["state"] in ["closed", "open", "half_open"]
+
 
 def test_get(uci_configs_init, infrastructure, start_buses):
     res = infrastructure.process_message(
@@ -141,6 +153,66 @@ def test_get(uci_configs_init, infrastructure, start_buses):
     assert set(res["data"]) == {"agreed", "firewall_status", "ucollect_status"}
 
 
+def test_get_all(uci_configs_init, infrastructure, start_buses):
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "get_all", "kind": "request"}
+    )
+    assert set(res["data"]) == {"agreed", "firewall_status", "ucollect_status", "honeypots"}
+    assert set(res["data"]["honeypots"]) == {"minipots", "log_credentials"}
+
+    res = infrastructure.process_message(
+        {
+            "module": "data_collect",
+            "action": "get_all",
+            "kind": "request",
+            "data": {"registration": {"email": "test@test.test", "language": "cs"}},
+        }
+    )
+    assert set(res["data"]) == {
+        "agreed", "firewall_status", "ucollect_status", "honeypots", "registration"
+    }
+    assert "status" in res["data"]["registration"]
+
+
+def test_get_sending_history(infrastructure, start_buses):
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "get_sending_history", "kind": "request"}
+    )
+    assert set(res["data"]) == {"interval", "capacity", "records"}
+    timestamps = [e["timestamp"] for e in res["data"]["records"]]
+    assert timestamps == sorted(timestamps)
+
+    res = infrastructure.process_message(
+        {
+            "module": "data_collect",
+            "action": "get_sending_history",
+            "kind": "request",
+            "data": {"from": 0, "to": 1},
+        }
+    )
+    assert res["data"]["records"] == []
+
+
+def test_get_sending_stats(infrastructure, start_buses):
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "get_sending_stats", "kind": "request"}
+    )
+    assert set(res["data"]) == {"firewall", "ucollect"}
+    for channel in res["data"].values():
+        assert set(channel) == {"1h", "24h", "7d"}
+
+
+def test_get_metrics(infrastructure, start_buses):
+    infrastructure.process_message({"module": "data_collect", "action": "get", "kind": "request"})
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "get_metrics", "kind": "request"}
+    )
+    assert set(res["data"]) == {"buckets_ms", "handlers", "subprocesses", "locks"}
+    assert res["data"]["handlers"]["get_agreed"]["count"] >= 1
+    for metric in res["data"]["handlers"].values():
+        assert len(metric["histogram"]) == len(res["data"]["buckets_ms"]) + 1
+
+
 def test_set(uci_configs_init, init_script_result, infrastructure, start_buses):
     def set_agreed(agreed):
         filters = [("data_collect", "set")]
@@ -155,7 +227,7 @@ def test_set(uci_configs_init, init_script_result, infrastructure, start_buses):
         )
         assert res == {
             u"action": u"set",
-            u"data": {u"result": True},
+            u"data": {u"result": True, u"applied": True},
             u"kind": u"reply",
             u"module": u"data_collect",
         }
@@ -184,7 +256,7 @@ def test_set_openwrt(uci_configs_init, init_script_result, infrastructure, start
     )
     assert res == {
         u"action": u"set",
-        u"data": {u"result": True},
+        u"data": {u"result": True, u"applied": True},
         u"kind": u"reply",
         u"module": u"data_collect",
     }
@@ -196,7 +268,7 @@ def test_set_openwrt(uci_configs_init, init_script_result, infrastructure, start
     )
     assert res == {
         u"action": u"set",
-        u"data": {u"result": True},
+        u"data": {u"result": True, u"applied": True},
         u"kind": u"reply",
         u"module": u"data_collect",
     }
@@ -204,6 +276,53 @@ def test_set_openwrt(uci_configs_init, init_script_result, infrastructure, start
     check_service_result("ucollect", "stop")
 
 
+@pytest.mark.only_backends(["openwrt"])
+def test_set_openwrt_opt_out(uci_configs_init, init_script_result, infrastructure, start_buses):
+    # agreement is not stored yet => explicit opt-out has to be applied
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "set", "kind": "request", "data": {"agreed": False}}
+    )
+    assert res["data"] == {"result": True, "applied": True}
+    check_service_result("ucollect", "disable", clean=False)
+    check_service_result("ucollect", "stop")
+
+    res = infrastructure.process_message(
+        {"module": "data_collect", "action": "set", "kind": "request", "data": {"agreed": False}}
+    )
+    assert res["data"] == {"result": True, "applied": False}
+
+
+def test_set_async(uci_configs_init, init_script_result, infrastructure, start_buses):
+    filters = [("data_collect", "set_finished")]
+
+    def set_agreed(agreed):
+        old_notifications = infrastructure.get_notifications(filters=filters)
+        res = infrastructure.process_message(
+            {
+                "module": "data_collect",
+                "action": "set",
+                "kind": "request",
+                "data": {"agreed": agreed, "async": True},
+            }
+        )
+        assert set(res["data"]) == {"result", "applied", "job_id"}
+        assert res["data"]["result"] is True
+        notifications = infrastructure.get_notifications(old_notifications, filters=filters)
+        assert notifications[-1] == {
+            u"module": u"data_collect",
+            u"action": u"set_finished",
+            u"kind": u"notification",
+            u"data": {u"job_id": res["data"]["job_id"], u"agreed": agreed, u"result": True},
+        }
+        res = infrastructure.process_message(
+            {"module": "data_collect", "action": "get", "kind": "request"}
+        )
+        assert res["data"]["agreed"] is agreed
+
+    set_agreed(True)
+    set_agreed(False)
+
+
 def test_get_honeypots(infrastructure, start_buses):
     res = infrastructure.process_message(
         {"module": "data_collect", "action": "get_honeypots", "kind": "request"}
@@ -236,7 +355,7 @@ def test_set_honeypots(infrastructure, init_script_result, start_buses):
         )
         assert res == {
             u"action": u"set_honeypots",
-            u"data": {u"result": True},
+            u"data": {u"result": True, u"applied": True},
             u"kind": u"reply",
             u"module": u"data_collect",
         }
@@ -307,7 +426,7 @@ def test_set_honeypots_service_restart(
     )
     assert res == {
         u"action": u"set_honeypots",
-        u"data": {u"result": True},
+        u"data": {u"result": True, u"applied": True},
         u"kind": u"reply",
         u"module": u"data_collect",
     }
@@ -323,7 +442,7 @@ def test_set_agreed_uci(uci_configs_init, init_script_result, infrastructure, st
     )
     assert res == {
         u"action": u"set",
-        u"data": {u"result": True},
+        u"data": {u"result": True, u"applied": True},
         u"kind": u"reply",
         u"module": u"data_collect",
     }
@@ -337,7 +456,7 @@ def test_set_agreed_uci(uci_configs_init, init_script_result, infrastructure, st
     )
     assert res == {
         u"action": u"set",
-        u"data": {u"result": True},
+        u"data": {u"result": True, u"applied": True},
         u"kind": u"reply",
         u"module": u"data_collect",
     }
@@ -346,3 +465,40 @@ def test_set_agreed_uci(uci_configs_init, init_script_result, infrastructure, st
         data = backend.read()
 
     assert not uci.parse_bool(uci.get_option_named(data, "foris", "eula", "agreed_collect", "0"))
+
+
+def test_set_noop(uci_configs_init, init_script_result, infrastructure, start_buses):
+    def set_agreed(agreed):
+        return infrastructure.process_message(
+            {"module": "data_collect", "action": "set", "kind": "request", "data": {"agreed": agreed}}
+        )
+
+    assert set_agreed(True)["data"] == {"result": True, "applied": True}
+    assert set_agreed(True)["data"] == {"result": True, "applied": False}
+
+
+@pytest.mark.only_backends(["openwrt"])
+def test_set_honeypots_noop(uci_configs_init, init_script_result, infrastructure, start_buses):
+    msg = {
+        "module": "data_collect",
+        "action": "set_honeypots",
+        "kind": "request",
+        "data": {
+            "minipots": {
+                "23tcp": True,
+                "2323tcp": False,
+                "80tcp": True,
+                "3128tcp": False,
+                "8123tcp": True,
+                "8080tcp": False,
+            },
+            "log_credentials": True,
+        },
+    }
+    res = infrastructure.process_message(msg)
+    assert res["data"] == {"result": True, "applied": True}
+    check_service_result("ucollect", "restart", clean=True)
+
+    res = infrastructure.process_message(msg)
+    assert res["data"] == {"result": True, "applied": False}
+    assert not os.path.exists("/tmp/test_init/ucollect")
@@ -0,0 +1,868 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Tests which use the openwrt backend directly (without the controller and buses) """
+
+import json
+import os
+import pytest
+import subprocess
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .conftest import (
+    REGISTRATION_CODE, cmdline_script_root, data_collect_backend, registered_script,
+    registration_code,
+)
+from foris_controller_testtools.fixtures import FILE_ROOT_PATH, init_script_result
+from foris_controller_testtools.utils import FileFaker
+
+
+def test_registration_cache_ttl(data_collect_backend):
+    cache = data_collect_backend.RegistrationCache(60, 0.2, 8)
+    cache.put(("a", "en", "X"), {"status": "owned"})
+    cache.put(("b", "en", "X"), {"status": "unknown"})
+    assert cache.get(("a", "en", "X")) == {"status": "owned"}
+    assert cache.get(("b", "en", "X")) == {"status": "unknown"}
+    time.sleep(0.3)
+    assert cache.get(("a", "en", "X")) == {"status": "owned"}
+    assert cache.get(("b", "en", "X")) is None
+
+
+def test_registration_cache_lru(data_collect_backend):
+    cache = data_collect_backend.RegistrationCache(60, 60, 2)
+    cache.put(("a", "en", "X"), {"status": "owned"})
+    cache.put(("b", "en", "X"), {"status": "owned"})
+    assert cache.get(("a", "en", "X"))  # "b" is now the least recently used
+    cache.put(("c", "en", "X"), {"status": "owned"})
+    assert cache.get(("a", "en", "X"))
+    assert cache.get(("b", "en", "X")) is None
+    assert cache.get(("c", "en", "X"))
+
+
+def test_registration_cache_persistence_symlink(data_collect_backend, tmp_path):
+    # the old fixed temporary name followed a planted symlink
+    victim = tmp_path / "victim"
+    victim.write_text("original")
+    path = tmp_path / "registration.json"
+    os.symlink(str(victim), str(path) + ".tmp")
+
+    cache = data_collect_backend.RegistrationCache(60, 10, 8, 60, str(path))
+    cache.put(("a", "en", "X"), {"status": "owned"})
+    assert victim.read_text() == "original"
+    assert json.loads(path.read_text())["entries"][0]["result"] == {"status": "owned"}
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "registration.json", "registration.json.tmp", "victim",
+    ]
+
+
+def test_registration_cache_persistence(data_collect_backend, tmp_path):
+    path = tmp_path / "registration.json"
+    cache = data_collect_backend.RegistrationCache(60, 10, 8, 60, str(path))
+    cache.put(("a", "en", "X"), {"status": "owned"})
+    cache.put(("b", "cs", "X"), {"status": "unknown"})
+    assert oct(path.stat().st_mode & 0o777) == oct(0o600)
+    assert json.loads(path.read_text())["version"] == 1
+
+    # loaded lazily on the first use
+    restarted = data_collect_backend.RegistrationCache(60, 10, 8, 60, str(path))
+    assert restarted._loaded is False
+    assert restarted.get(("a", "en", "X")) == {"status": "owned"}
+    assert restarted.get(("b", "cs", "X")) == {"status": "unknown"}
+    assert restarted.get(("a", "en", "Y")) is None
+
+    # stale entries are dropped, expiration is limited by the current ttl
+    data = json.loads(path.read_text())
+    data["entries"][0]["expires_at"] = time.time() - 120
+    data["entries"][1]["expires_at"] = time.time() + 3600
+    path.write_text(json.dumps(data))
+    restarted = data_collect_backend.RegistrationCache(60, 10, 8, 60, str(path))
+    assert restarted.lookup(("a", "en", "X")) == (None, False)
+    restarted.transient_ttl = 0.1
+    restarted._loaded = False
+    restarted._entries.clear()
+    assert restarted.get(("b", "cs", "X")) == {"status": "unknown"}
+    time.sleep(0.2)
+    assert restarted.get(("b", "cs", "X")) is None
+
+    # corrupted and unknown files are ignored
+    for content in ["{not json", '{"version": 2, "entries": []}', '{"version": 1}', "[]"]:
+        path.write_text(content)
+        broken = data_collect_backend.RegistrationCache(60, 10, 8, 60, str(path))
+        assert broken.get(("a", "en", "X")) is None
+        broken.put(("c", "en", "X"), {"status": "owned"})
+        assert json.loads(path.read_text())["version"] == 1
+
+
+def test_get_registered_persisted(
+    data_collect_backend, cmdline_script_root, registration_code, monkeypatch, tmp_path
+):
+    monkeypatch.setenv(
+        "FORIS_DATA_COLLECT_REGISTERED_CACHE_PATH", str(tmp_path / "registration.json")
+    )
+    path = "/usr/share/server-uplink/registered.sh"
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("free")):
+        assert data_collect_backend.RegisteredCmds().get_registered(
+            "test@test.test", "en"
+        )["status"] == "free"
+
+    # a new instance (restarted controller) doesn't run the script
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned")):
+        res = data_collect_backend.RegisteredCmds().get_registered("test@test.test", "en")
+        assert res["status"] == "free"
+        assert res["registration_number"] == REGISTRATION_CODE
+
+
+def test_get_registered_cached(data_collect_backend, cmdline_script_root, registration_code):
+    cmds = data_collect_backend.RegisteredCmds()
+    path = "/usr/share/server-uplink/registered.sh"
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("free")):
+        assert cmds.get_registered("test@test.test", "en")["status"] == "free"
+
+    # cached answer is returned without running the script
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned")):
+        res = cmds.get_registered("test@test.test", "en")
+        assert res["status"] == "free"
+        assert res["registration_number"] == REGISTRATION_CODE
+
+        # different key
+        assert cmds.get_registered("test@test.test", "cs")["status"] == "owned"
+
+        cmds.cache.clear()
+        assert cmds.get_registered("test@test.test", "en")["status"] == "owned"
+
+
+def test_get_registered_single_flight(
+    data_collect_backend, cmdline_script_root, registration_code, tmp_path
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    log = tmp_path / "registered.log"
+    results = []
+
+    def query():
+        results.append(cmds.get_registered("test@test.test", "en"))
+
+    with FileFaker(
+        cmdline_script_root,
+        "/usr/share/server-uplink/registered.sh",
+        True,
+        registered_script("owned", delay=1, log=str(log)),
+    ):
+        threads = [threading.Thread(target=query) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [{"status": "owned"}] * 20
+    assert len(log.read_text().splitlines()) == 1
+
+
+def test_get_registered_stale_while_revalidate(
+    data_collect_backend, cmdline_script_root, registration_code
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    cmds.cache.final_ttl = 0.2
+    cmds.cache.stale_ttl = 60
+    path = "/usr/share/server-uplink/registered.sh"
+    changed = []
+    refreshed = threading.Event()
+
+    def on_change(result):
+        changed.append(result)
+        refreshed.set()
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("free")):
+        assert cmds.get_registered("test@test.test", "en", on_change)["status"] == "free"
+
+    time.sleep(0.3)
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned", delay=0.5)):
+        res = cmds.get_registered("test@test.test", "en", on_change)
+        assert res["status"] == "free"
+        assert res["stale"] is True
+
+        assert refreshed.wait(5)
+        assert changed == [{"status": "owned"}]
+        assert cmds.get_registered("test@test.test", "en", on_change) == {"status": "owned"}
+
+
+def test_get_registered_refresh_failure(
+    data_collect_backend, cmdline_script_root, registration_code
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    cmds.cache.final_ttl = 0.2
+    cmds.cache.stale_ttl = 60
+    path = "/usr/share/server-uplink/registered.sh"
+    changed = []
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned")):
+        assert cmds.get_registered("test@test.test", "en", changed.append) == {"status": "owned"}
+
+    time.sleep(0.3)
+
+    with FileFaker(cmdline_script_root, path, True, "#!/bin/sh\nexit 1\n"):
+        for _ in range(2):
+            res = cmds.get_registered("test@test.test", "en", changed.append)
+            assert res == {"status": "owned", "stale": True}
+            # wait for the background refresh
+            for _ in range(50):
+                if not cmds._refreshing:
+                    break
+                time.sleep(0.1)
+            assert not cmds._refreshing
+
+    # last known status is kept and nothing is reported
+    assert changed == []
+    assert cmds.cache.lookup(("test@test.test", "en", REGISTRATION_CODE)) == (
+        {"status": "owned"}, False
+    )
+
+
+def test_get_registered_deadline(
+    data_collect_backend, cmdline_script_root, registration_code, tmp_path
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    marker = tmp_path / "finished"
+    registered = "/usr/share/server-uplink/registered.sh"
+    slow_script = "#!/bin/sh\nsleep 1\ntouch %s\n" % marker
+
+    with FileFaker(cmdline_script_root, registered, True, slow_script):
+        start = time.monotonic()
+        res = cmds.get_registered("test@test.test", "en", timeout=0.3)
+        assert time.monotonic() - start < 0.9
+        assert res == {"status": "unknown", "reason": "timeout"}
+
+        # script was killed
+        time.sleep(1.2)
+        assert not marker.exists()
+
+    # timeout is not cached
+    with FileFaker(cmdline_script_root, registered, True, registered_script("owned")):
+        assert cmds.get_registered("test@test.test", "en", timeout=5) == {"status": "owned"}
+
+    # deadline covers registration_code.sh retry as well
+    cmds.cache.clear()
+    with FileFaker(
+        cmdline_script_root, registered, True, registered_script("free", code=404)
+    ), FileFaker(
+        cmdline_script_root, "/usr/share/server-uplink/registration_code.sh", True, slow_script
+    ):
+        start = time.monotonic()
+        res = cmds.get_registered("test@test.test", "en", timeout=0.3)
+        assert time.monotonic() - start < 0.9
+        assert res == {"status": "unknown", "reason": "timeout"}
+
+
+def test_get_registered_deadline_joined(
+    data_collect_backend, cmdline_script_root, registration_code
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    cmds.cache.final_ttl = 0
+    path = "/usr/share/server-uplink/registered.sh"
+    results = {}
+
+    def query(name, timeout):
+        start = time.monotonic()
+        res = cmds.get_registered("test@test.test", "en", timeout=timeout)
+        results[name] = (res, time.monotonic() - start)
+
+    def run(*queries):
+        threads = []
+        for name, timeout in queries:
+            threads.append(threading.Thread(target=query, args=(name, timeout)))
+            threads[-1].start()
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned", delay=1)):
+        # follower with a shorter deadline doesn't wait for the leader
+        run(("leader", None), ("follower", 0.3))
+        assert results["follower"][0] == {"status": "unknown", "reason": "timeout"}
+        assert results["follower"][1] < 0.7
+        assert results["leader"][0] == {"status": "owned"}
+
+        # follower with a longer deadline is not limited by the leader's one
+        run(("leader", 0.3), ("follower", 5))
+        assert results["leader"][0] == {"status": "unknown", "reason": "timeout"}
+        assert results["follower"][0] == {"status": "owned"}
+
+        # timeout is limited by the module default
+        cmds.timeout = 0.3
+        start = time.monotonic()
+        res = cmds.get_registered("test@test.test", "en", timeout=1e9)
+        assert res == {"status": "unknown", "reason": "timeout"}
+        assert time.monotonic() - start < 0.9
+
+
+def test_circuit_breaker(data_collect_backend):
+    breaker = data_collect_backend.CircuitBreaker(3, 0.2)
+    assert breaker.status() == {
+        "state": "closed", "failures": 0, "opened_at": None, "retry_in": None
+    }
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    breaker.success()  # resets consecutive failures
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.failure()
+
+    status = breaker.status()
+    assert status["state"] == "open"
+    assert status["failures"] == 3
+    assert 0 < status["retry_in"] <= 0.2
+    assert not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.allow()  # probe
+    assert breaker.status()["state"] == "half_open"
+    assert not breaker.allow()  # only a single probe
+    breaker.failure()
+    assert breaker.status()["state"] == "open"
+
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.release()  # probe didn't contact the server
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.status()["state"] == "closed"
+
+    disabled = data_collect_backend.CircuitBreaker(0, 60)
+    for _ in range(10):
+        assert disabled.allow()
+        disabled.failure()
+    assert disabled.status()["state"] == "closed"
+
+
+def test_get_registered_circuit_breaker(
+    data_collect_backend, cmdline_script_root, registration_code, tmp_path
+):
+    cmds = data_collect_backend.RegisteredCmds()
+    cmds.cache.transient_ttl = 0
+    cmds.breaker = data_collect_backend.CircuitBreaker(2, 0.3)
+    log = tmp_path / "registered.log"
+    path = "/usr/share/server-uplink/registered.sh"
+    failing_script = "#!/bin/sh\necho \"$@\" >> %s\nexit 1\n" % log
+
+    with FileFaker(cmdline_script_root, path, True, failing_script):
+        for _ in range(2):
+            assert cmds.get_registered("test@test.test", "en") == {
+                "status": "unknown", "reason": "unreachable"
+            }
+        assert cmds.get_server_status()["state"] == "open"
+
+        # scripts are not run while the breaker is open
+        assert cmds.get_registered("test@test.test", "en") == {
+            "status": "unknown", "reason": "circuit_open"
+        }
+        assert len(log.read_text().splitlines()) == 2
+
+    time.sleep(0.35)
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned")):
+        assert cmds.get_registered("test@test.test", "en") == {"status": "owned"}
+    assert cmds.get_server_status()["state"] == "closed"
+
+
+class RegistrationServer(ThreadingHTTPServer):
+    """ Stand-in of the registration server (answers like registered.sh prints) """
+    daemon_threads = True
+
+    def __init__(self):
+        super(RegistrationServer, self).__init__(("127.0.0.1", 0), RegistrationRequestHandler)
+        self.status = "free"
+        self.code = 200
+        self.requests = []  # (client port, query)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/lookup?code={code}&email={email}&lang={language}" % (
+            self.server_address[1]
+        )
+
+
+class RegistrationRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        self.server.requests.append((self.client_address[1], query))
+        body = (
+            "status: %s\nurl: https://some.page/%s/data?email=%s&registration_code=%s\n"
+            % (self.server.status, query["lang"][0], query["email"][0], query["code"][0])
+        ).encode()
+        self.send_response(self.server.code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def registration_server():
+    server = RegistrationServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_registration_http_client_keep_alive(data_collect_backend, registration_server):
+    from foris_controller_backends.data_collect.registration_client import (
+        RegistrationHttpClient, RegistrationQueryFailed
+    )
+
+    client = RegistrationHttpClient(registration_server.url, timeout=5)
+    for _ in range(5):
+        code, body = client.query(REGISTRATION_CODE, "test+1@test.test", "cs")
+        assert code == 200
+        assert "status: free" in body
+
+    ports = {port for port, _ in registration_server.requests}
+    assert len(ports) == 1  # single persistent connection
+    assert registration_server.requests[0][1] == {
+        "code": [REGISTRATION_CODE], "email": ["test+1@test.test"], "lang": ["cs"],
+    }
+
+    # server is not available
+    registration_server.shutdown()
+    registration_server.server_close()
+    client.close()
+    with pytest.raises(RegistrationQueryFailed):
+        client.query(REGISTRATION_CODE, "test@test.test", "en")
+
+
+def test_get_registered_http(
+    data_collect_backend, cmdline_script_root, registration_code, registration_server,
+    monkeypatch, tmp_path,
+):
+    monkeypatch.setenv("FORIS_DATA_COLLECT_REGISTRATION_URL", registration_server.url)
+    cmds = data_collect_backend.RegisteredCmds()
+    log = tmp_path / "registered.log"
+    path = "/usr/share/server-uplink/registered.sh"
+
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned", log=str(log))):
+        res = cmds.get_registered("test@test.test", "en")
+        assert res["status"] == "free"
+        assert res["registration_number"] == REGISTRATION_CODE
+        assert res["url"].startswith("https://some.page/en/data?email=test@test.test")
+
+        registration_server.status = "owned"
+        cmds.cache.clear()
+        assert cmds.get_registered("test@test.test", "en") == {"status": "owned"}
+        assert not log.exists()  # script was not used
+
+        # server is not available => fallback to the script
+        registration_server.shutdown()
+        registration_server.server_close()
+        cmds.http_client.close()
+        cmds.cache.clear()
+        assert cmds.get_registered("test@test.test", "cs") == {"status": "owned"}
+        assert len(log.read_text().splitlines()) == 1
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://127.0.0.1/lookup?code={code}",
+        "http://127.0.0.1/lookup?code={code}&lang={lang}",
+        "http://127.0.0.1/lookup?code={code}&x={",
+    ],
+    ids=["scheme", "placeholder", "syntax"],
+)
+def test_get_registered_bad_url(
+    data_collect_backend, cmdline_script_root, registration_code, monkeypatch, url
+):
+    monkeypatch.setenv("FORIS_DATA_COLLECT_REGISTRATION_URL", url)
+    cmds = data_collect_backend.RegisteredCmds()
+    assert cmds.http_client is None
+
+    # script is used instead
+    path = "/usr/share/server-uplink/registered.sh"
+    with FileFaker(cmdline_script_root, path, True, registered_script("owned")):
+        assert cmds.get_registered("test@test.test", "en") == {"status": "owned"}
+
+
+def test_registration_code_file(data_collect_backend):
+    code_file = data_collect_backend.RegistrationCodeFile()
+    path = "/usr/share/server-uplink/registration_code"
+
+    assert code_file.get_registration_code() is None
+
+    with FileFaker(FILE_ROOT_PATH, path, False, REGISTRATION_CODE + "\n"):
+        assert code_file.get_registration_code() == REGISTRATION_CODE
+        assert code_file.get_registration_code() == REGISTRATION_CODE
+
+    # changed file is read again
+    with FileFaker(FILE_ROOT_PATH, path, False, "0000000B00009CD7\n"):
+        assert code_file.get_registration_code() == "0000000B00009CD7"
+
+
+def test_sending_info_change_detection(data_collect_backend):
+    files = data_collect_backend.SendingFiles()
+
+    with FileFaker(
+        FILE_ROOT_PATH,
+        files.FW_PATH,
+        False,
+        "turris firewall working: yes\nlast working timestamp: 1501857960\n",
+    ), FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "online 1501857970"):
+        assert files.get_sending_info() == {
+            "firewall_status": {"state": "online", "last_check": 1501857960},
+            "ucollect_status": {"state": "online", "last_check": 1501857970},
+        }
+        assert files.get_sending_info()["firewall_status"]["state"] == "online"
+
+    with FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "offline 1501857980"):
+        assert files.get_sending_info() == {
+            "firewall_status": {"state": "unknown", "last_check": 0},
+            "ucollect_status": {"state": "offline", "last_check": 1501857980},
+        }
+
+
+@pytest.mark.parametrize("use_inotify", [True, False], ids=["inotify", "polling"])
+def test_sending_status_watcher(data_collect_backend, use_inotify):
+    files = data_collect_backend.SendingFiles()
+    notifications = []
+    changed = threading.Event()
+
+    def notify(msg):
+        notifications.append(msg)
+        changed.set()
+
+    with FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "online 1501857970"):
+        watcher = data_collect_backend.SendingStatusWatcher(
+            notify, files, poll_interval=0.1, use_inotify=use_inotify
+        )
+        watcher.start()
+        try:
+            # only last_check changes => no transition
+            with open(os.path.join(FILE_ROOT_PATH, files.UC_PATH.lstrip("/")), "w") as f:
+                f.write("online 1501857980")
+            assert not changed.wait(0.5)
+
+            with open(os.path.join(FILE_ROOT_PATH, files.UC_PATH.lstrip("/")), "w") as f:
+                f.write("offline 1501857990")
+            assert changed.wait(2)
+        finally:
+            watcher.stop()
+
+    assert notifications == [
+        {
+            "firewall_status": {"state": "unknown", "last_check": 0},
+            "ucollect_status": {"state": "offline", "last_check": 1501857990},
+        }
+    ]
+
+
+def test_uci_snapshots(data_collect_backend, monkeypatch, tmp_path):
+    reads = []
+
+    class FakeUciBackend(object):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def read(self, config):
+            reads.append(config)
+            return {"config": config, "read": len(reads)}
+
+    monkeypatch.setattr("foris_controller_backends.uci.UciBackend", FakeUciBackend)
+    monkeypatch.setenv("FORIS_UCI_CONFIG_DIR", str(tmp_path))
+    snapshots = data_collect_backend.UciSnapshots()
+
+    # missing file => no caching
+    snapshots.read("foris")
+    snapshots.read("foris")
+    assert len(reads) == 2
+
+    (tmp_path / "foris").write_text("package foris\n")
+    assert snapshots.read("foris")["read"] == 3
+    assert snapshots.read("foris")["read"] == 3
+
+    # changed file
+    (tmp_path / "foris").write_text("package foris\n\nconfig config 'eula'\n")
+    assert snapshots.read("foris")["read"] == 4
+
+    snapshots.invalidate("foris")
+    assert snapshots.read("foris")["read"] == 5
+    assert snapshots.read("foris")["read"] == 5
+
+
+def test_service_scheduler(data_collect_backend, init_script_result):
+    scheduler = data_collect_backend.ServiceScheduler(0.5)
+    for _ in range(3):
+        scheduler.schedule("ucollect", "restart")
+    assert not os.path.exists("/tmp/test_init/ucollect")
+
+    time.sleep(1.0)
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed restart"]
+
+    # a new window
+    scheduler.schedule("ucollect", "restart")
+    scheduler.flush()
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed restart", "passed restart"]
+
+
+def test_service_scheduler_stop(data_collect_backend, init_script_result):
+    scheduler = data_collect_backend.ServiceScheduler(0.5)
+    scheduler.schedule("ucollect", "restart")
+
+    # stop is performed right away and it cancels the pending restart
+    scheduler.schedule("ucollect", "stop")
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed stop"]
+
+    time.sleep(1.0)
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed stop"]
+
+    # restart requested after the stop is still performed
+    scheduler.schedule("ucollect", "restart")
+    time.sleep(1.0)
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed stop", "passed restart"]
+
+
+def test_service_scheduler_exit(data_collect_backend, init_script_result):
+    script = "; ".join([
+        "import threading",
+        "from foris_controller.app import app_info",
+        "app_info.setdefault('lock_backend', threading)",
+        "import foris_controller_backends.data_collect as backend",
+        "backend.service_scheduler.schedule('ucollect', 'restart')",
+    ])
+    env = dict(os.environ, FORIS_DATA_COLLECT_RESTART_DELAY="60")
+    subprocess.run(
+        [sys.executable, "-c", script],
+        env=env, cwd=os.path.dirname(os.path.dirname(__file__)), timeout=30, check=True,
+    )
+
+    # pending restart is performed when the process exits (not after the delay)
+    with open("/tmp/test_init/ucollect") as f:
+        assert f.read().splitlines() == ["passed restart"]
+
+
+def test_set_agreed_async_toggles(data_collect_backend, monkeypatch):
+    actions = []
+
+    class Scheduler(object):
+        def schedule(self, service, action):
+            actions.append(action)
+
+        def flush(self):
+            pass
+
+    class Uci(data_collect_backend.DataCollectUci):
+        agreed = False
+
+        def get_agreed(self):
+            return self.agreed
+
+        def _store_agreed(self, agreed):
+            self.agreed = agreed
+            return True
+
+        def _update_service(self, agreed):
+            # enabling is slow => the second job would overtake the first one
+            time.sleep(0.5 if agreed else 0.0)
+            actions.append("enable" if agreed else "disable")
+
+    monkeypatch.setattr(data_collect_backend, "service_scheduler", Scheduler())
+    uci = Uci()
+    finished = []
+    done = threading.Event()
+
+    def exit_notify(msg):
+        finished.append(msg)
+        if len(finished) == 2:
+            done.set()
+
+    uci.set_agreed_async(True, exit_notify)
+    time.sleep(0.1)
+    uci.set_agreed_async(False, exit_notify)
+    assert done.wait(5)
+
+    assert all(e["result"] for e in finished)
+    # service ends up in the state of the last agreement
+    assert actions[-2:] == ["disable", "stop"]
+
+
+def test_sending_history_ring_buffer(data_collect_backend, tmp_path):
+    from foris_controller_backends.data_collect.history import SendingHistory
+
+    history = SendingHistory(4)
+    for i in range(6):
+        history.append(100 + i, "online" if i % 2 else "offline", "unknown")
+
+    assert len(history) == 4
+    assert [e[0] for e in history.records()] == [102, 103, 104, 105]
+    assert history.records(103, 104) == [(103, "online", "unknown"), (104, "offline", "unknown")]
+
+    path = str(tmp_path / "history")
+    history.dump(path)
+    loaded = SendingHistory(4)
+    assert loaded.load(path)
+    assert loaded.records() == history.records()
+
+    with open(path, "wb") as f:
+        f.write(b"corrupted")
+    assert not SendingHistory(4).load(path)
+
+
+def test_sending_history_clock_step_back(data_collect_backend):
+    from foris_controller_backends.data_collect.history import SendingHistory
+
+    history = SendingHistory(8)
+    for timestamp in [100, 200, 300, 50, 60]:
+        history.append(timestamp, "online", "online")
+
+    # older timestamps are clamped so the records stay ordered
+    assert [e[0] for e in history.records()] == [100, 200, 300, 300, 300]
+    assert [e[0] for e in history.records(150, 400)] == [200, 300, 300, 300]
+    assert history.records(40, 70) == []
+
+
+def test_sending_sampler(data_collect_backend, tmp_path):
+    files = data_collect_backend.SendingFiles()
+    path = str(tmp_path / "history")
+
+    with FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "online 1501857970"):
+        sampler = data_collect_backend.SendingSampler(files, 0, 10, path)
+        sampler.sample()
+        sampler.sample()
+
+    assert [e[1:] for e in sampler.history.records()] == [("unknown", "online")] * 2
+
+    # persisted history is loaded on start
+    restarted = data_collect_backend.SendingSampler(files, 0, 10, path)
+    restarted.start()
+    assert restarted.history.records() == sampler.history.records()
+
+
+def test_availability_stats(data_collect_backend):
+    from foris_controller_backends.data_collect.history import AvailabilityStats
+
+    stats = AvailabilityStats(120)
+    start = 1501857960
+    for i in range(61):
+        stats.add_sample(start + i * 60, "offline" if 20 <= i < 30 else "online", "online")
+
+    summary = stats.summary(start + 60 * 60)
+    assert summary["firewall"]["1h"] == {
+        "online_percent": 83.333, "transitions": 2, "longest_outage": 600.0
+    }
+    assert summary["ucollect"]["7d"] == {
+        "online_percent": 100.0, "transitions": 0, "longest_outage": 0.0
+    }
+
+    # the first hour falls out of the 1h window
+    stats.add_sample(start + 2 * 60 * 60, "online", "online")
+    summary = stats.summary(start + 2 * 60 * 60)
+    assert summary["firewall"]["1h"]["transitions"] == 0
+    assert summary["firewall"]["24h"]["transitions"] == 2
+
+    # outage longer than the window is capped whether it is ongoing or has just ended
+    start += 3 * 60 * 60
+    for i in range(5 * 60 + 1):
+        stats.add_sample(start + i * 60, "offline", "online")
+    ongoing = stats.summary(start + 5 * 60 * 60)["firewall"]
+    stats.add_sample(start + (5 * 60 + 1) * 60, "online", "online")
+    ended = stats.summary(start + (5 * 60 + 1) * 60)["firewall"]
+    assert ongoing["1h"]["longest_outage"] == ended["1h"]["longest_outage"] == 3600.0
+    assert ended["24h"]["longest_outage"] == 18060.0
+
+
+def test_metrics(data_collect_backend):
+    from foris_controller_backends.data_collect.metrics import Metrics
+
+    metrics = Metrics()
+
+    @metrics.timed("handlers")
+    def handler_call(fail):
+        if fail:
+            raise ValueError()
+
+    handler_call(False)
+    with pytest.raises(ValueError):
+        handler_call(True)
+    with metrics.timer("subprocesses", "registered.sh") as timer:
+        timer.error = True
+    metrics.observe("locks", "sending_files.file_lock", 0.003)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["handlers"]["handler_call"]["count"] == 2
+    assert snapshot["handlers"]["handler_call"]["errors"] == 1
+    assert snapshot["subprocesses"]["registered.sh"]["errors"] == 1
+    lock = snapshot["locks"]["sending_files.file_lock"]
+    assert lock["histogram"][snapshot["buckets_ms"].index(5)] == 1
+
+
+def test_prometheus_exporter(data_collect_backend, tmp_path):
+    from foris_controller_backends.data_collect.exporter import PrometheusExporter
+    from foris_controller_backends.data_collect.metrics import Metrics
+
+    class Uci(object):
+        agreed = True
+
+        def get_agreed(self):
+            return self.agreed
+
+    files = data_collect_backend.SendingFiles()
+    uci = Uci()
+    metrics = Metrics()
+    metrics.observe("handlers", "get_agreed", 0.004)
+    path = str(tmp_path / "data_collect.prom")
+    exporter = PrometheusExporter(path, files, uci, metrics)
+
+    with FileFaker(FILE_ROOT_PATH, files.UC_PATH, False, "online 1501857970"):
+        assert exporter.export()
+        assert not exporter.export()  # nothing changed
+        uci.agreed = False
+        assert exporter.export()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert "foris_data_collect_agreed 0" in lines
+    assert 'foris_data_collect_sending_state{channel="ucollect",state="online"} 1' in lines
+    assert 'foris_data_collect_sending_state{channel="firewall",state="unknown"} 1' in lines
+    assert 'foris_data_collect_last_check_timestamp_seconds{channel="ucollect"} 1501857970' in lines
+    assert 'foris_data_collect_calls_total{group="handlers",name="get_agreed"} 1' in lines
+    assert (
+        'foris_data_collect_duration_seconds_bucket{group="handlers",name="get_agreed",le="0.005"} 1'
+        in lines
+    )
+    assert os.listdir(str(tmp_path)) == ["data_collect.prom"]  # no leftover temporary files
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
@@ -0,0 +1,157 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import threading
+import time
+
+import pytest
+
+from foris_controller_data_collect_module.loadgen import (
+    DEFAULT_MIX, LoadGenerator, _payloads, format_report, make_sender_factory, parse_mix,
+    percentile,
+)
+from foris_controller_modules.data_collect import DataCollectModule
+from foris_controller_testtools.fixtures import (
+    infrastructure,
+    uci_configs_init,
+    start_buses,
+    mosquitto_test,
+    ubusd_test,
+)
+
+
+class FakeSender(object):
+    instances = []
+    lock = threading.Lock()
+
+    def __init__(self, fail_actions=()):
+        self.fail_actions = fail_actions
+        self.sent = []
+        self.disconnected = False
+        with self.lock:
+            self.instances.append(self)
+
+    def send(self, module, action, data):
+        assert module == "data_collect"
+        self.sent.append((action, data))
+        time.sleep(0.001)
+        if action in self.fail_actions:
+            raise RuntimeError("failed")
+        return {}
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.fixture
+def payloads():
+    return _payloads("test@example.com", "en")
+
+
+def test_actions(payloads):
+    # only actions of the module can be generated
+    for action in payloads:
+        assert hasattr(DataCollectModule, "action_%s" % action), action
+
+
+def test_parse_mix(payloads):
+    assert parse_mix("get=3, get_registered, set=0", payloads) == [
+        ("get", 3.0), ("get_registered", 1.0)
+    ]
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1", payloads)
+    with pytest.raises(ValueError):
+        parse_mix("get=-1", payloads)
+    with pytest.raises(ValueError):
+        parse_mix("get=0", payloads)
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile(list(range(100)), 50) == 50
+    assert percentile(list(range(100)), 99) == 99
+    assert percentile([1], 99) == 1
+
+
+def test_requests(payloads):
+    FakeSender.instances = []
+    generator = LoadGenerator(
+        FakeSender, parse_mix("get=1,get_registered=1", payloads), payloads,
+        clients=4, requests=200, seed=1,
+    )
+    report = generator.run()
+
+    assert report["requests"] == 200
+    assert report["errors"] == 0
+    assert report["overall"]["count"] == 200
+    assert set(report["actions"]) == {"get", "get_registered"}
+    assert report["throughput"] > 0
+
+    assert len(FakeSender.instances) == 4
+    assert all(e.disconnected for e in FakeSender.instances)
+    sent = [e for sender in FakeSender.instances for e in sender.sent]
+    assert ("get_registered", {"email": "test@example.com", "language": "en"}) in sent
+    assert ("get", None) in sent
+
+    assert "TOTAL" in format_report(report)
+
+
+def test_duration_and_errors(payloads):
+    generator = LoadGenerator(
+        lambda: FakeSender(fail_actions=["set"]), parse_mix("get=1,set=1", payloads), payloads,
+        clients=2, duration=0.2,
+    )
+    start = time.monotonic()
+    report = generator.run()
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+    assert report["errors"] > 0
+    assert report["errors"] == report["actions"]["set"]["errors"]
+    assert report["actions"]["set"]["count"] == 0
+    assert report["error_types"] == {"set:RuntimeError": report["errors"]}
+    assert "set:RuntimeError" in format_report(report)
+
+
+def test_connect_failure(payloads):
+    def factory():
+        raise ConnectionRefusedError()
+
+    report = LoadGenerator(factory, parse_mix("get", payloads), payloads, requests=10).run()
+    assert report["requests"] == 1
+    assert report["error_types"] == {"connect:ConnectionRefusedError": 1}
+
+
+def test_controller(payloads, uci_configs_init, infrastructure, start_buses):
+    from foris_controller_testtools.infrastructure import (
+        MQTT_HOST, MQTT_ID, MQTT_PORT, SOCK_PATH, UBUS_PATH
+    )
+
+    sender_factory = make_sender_factory(
+        infrastructure.name, {"unix-socket": SOCK_PATH, "ubus": UBUS_PATH}.get(infrastructure.name),
+        MQTT_HOST, MQTT_PORT, MQTT_ID, timeout=30,
+    )
+    generator = LoadGenerator(
+        sender_factory, parse_mix(DEFAULT_MIX, payloads), payloads,
+        clients=2, requests=20, seed=1,
+    )
+    report = generator.run()
+
+    assert report["error_types"] == {}
+    assert report["requests"] == 20
+    assert report["overall"]["count"] == 20
@@ -0,0 +1,142 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import json
+import threading
+import time
+
+import pytest
+
+from foris_controller_modules.data_collect.handlers.mock import (
+    MockBehavior, MockDataCollectHandler, MockFailure, MockTimeout
+)
+
+
+def make_handler(monkeypatch, config):
+    monkeypatch.setenv(MockBehavior.ENV, json.dumps(config))
+    return MockDataCollectHandler()
+
+
+def test_seeded(monkeypatch):
+    first = make_handler(monkeypatch, {"seed": 42})
+    second = make_handler(monkeypatch, {"seed": 42})
+    for _ in range(10):
+        assert first.get_registered("a@b.c", "en") == second.get_registered("a@b.c", "en")
+        assert first.get_sending_info() == second.get_sending_info()
+
+
+def test_latency(monkeypatch):
+    handler = make_handler(monkeypatch, {
+        "default": {"latency": {"distribution": "constant", "ms": 0}},
+        "methods": {"get_agreed": {"latency": {"distribution": "uniform", "min_ms": 50,
+                                               "max_ms": 60}}},
+    })
+
+    start = time.monotonic()
+    handler.get_agreed()
+    assert time.monotonic() - start >= 0.05
+
+    start = time.monotonic()
+    handler.get_honeypots()
+    assert time.monotonic() - start < 0.05
+
+
+@pytest.mark.parametrize("distribution", [
+    {"distribution": "constant", "ms": 5},
+    {"distribution": "uniform", "min_ms": 1, "max_ms": 5},
+    {"distribution": "normal", "mean_ms": 5, "stddev_ms": 10},
+    {"distribution": "exponential", "mean_ms": 5},
+    {"distribution": "lognormal", "median_ms": 5, "sigma": 0.5},
+])
+def test_latency_distributions(distribution):
+    behavior = MockBehavior({"seed": 1, "default": {"latency": distribution}})
+    delays = [behavior.plan("get_agreed")[0] for _ in range(200)]
+    assert all(e >= 0 for e in delays)
+    assert 0.001 < sum(delays) / len(delays) < 0.02
+
+
+def test_failures(monkeypatch):
+    handler = make_handler(monkeypatch, {
+        "seed": 1, "methods": {"set_agreed": {"failure_rate": 1.0}},
+    })
+    with pytest.raises(MockFailure):
+        handler.set_agreed(True)
+    assert handler.get_agreed() is False
+
+    behavior = MockBehavior({"seed": 1, "default": {"failure_rate": 0.3}})
+    failures = [behavior.plan("get_agreed")[1] for _ in range(1000)]
+    assert 200 < failures.count(MockFailure) < 400
+
+
+def test_timeouts(monkeypatch):
+    handler = make_handler(monkeypatch, {
+        "timeout_ms": 50, "default": {"timeout_rate": 1.0},
+    })
+    start = time.monotonic()
+    with pytest.raises(MockTimeout):
+        handler.get_sending_stats()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_invalid_config(monkeypatch, tmpdir):
+    with pytest.raises(ValueError):
+        MockBehavior({"default": {"latency": {"distribution": "unknown"}}})
+
+    # invalid configuration in env is ignored
+    monkeypatch.setenv(MockBehavior.ENV, "{not json")
+    assert MockDataCollectHandler().get_agreed() is False
+
+    path = tmpdir.join("mock.json")
+    path.write(json.dumps({"default": {"failure_rate": 1.0}}))
+    monkeypatch.setenv(MockBehavior.ENV, str(path))
+    with pytest.raises(MockFailure):
+        MockDataCollectHandler().get_agreed()
+
+
+def test_instance_state(monkeypatch):
+    monkeypatch.delenv(MockBehavior.ENV, raising=False)
+    first = MockDataCollectHandler()
+    second = MockDataCollectHandler()
+
+    settings = first.get_honeypots()
+    settings["minipots"]["23tcp"] = True
+    assert first.set_honeypots(settings)["applied"] is True
+    assert first.get_honeypots()["minipots"]["23tcp"] is True
+    assert second.get_honeypots()["minipots"]["23tcp"] is False
+
+    # returned state is not shared with the handler
+    first.get_honeypots()["minipots"]["23tcp"] = False
+    assert first.get_honeypots()["minipots"]["23tcp"] is True
+
+
+def test_concurrent_set(monkeypatch):
+    monkeypatch.delenv(MockBehavior.ENV, raising=False)
+    handler = MockDataCollectHandler()
+    results = []
+
+    def worker():
+        results.append(handler.set_agreed(True)["applied"])
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
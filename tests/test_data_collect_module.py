@@ -0,0 +1,140 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Tests which use the module directly (without the controller and buses) """
+
+import os
+import pytest
+import subprocess
+import sys
+import threading
+import time
+
+from foris_controller_modules.data_collect import DataCollectModule
+
+DELAY = 0.3
+
+
+class SlowHandler(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def get_agreed(self):
+        time.sleep(DELAY)
+        if self.fail:
+            raise RuntimeError("get_agreed failed")
+        return True
+
+    def get_sending_info(self):
+        time.sleep(DELAY)
+        return {
+            "firewall_status": {"state": "online", "last_check": 1501857960},
+            "ucollect_status": {"state": "offline", "last_check": 1501857970},
+        }
+
+
+def make_module(handler):
+    module = DataCollectModule.__new__(DataCollectModule)
+    module.handler = handler
+    return module
+
+
+def test_action_get_parallel():
+    module = make_module(SlowHandler())
+
+    start = time.monotonic()
+    res = module.action_get({})
+    elapsed = time.monotonic() - start
+
+    assert res == {
+        "agreed": True,
+        "firewall_status": {"state": "online", "last_check": 1501857960},
+        "ucollect_status": {"state": "offline", "last_check": 1501857970},
+    }
+    # slowest call rather than the sum of both
+    assert elapsed < DELAY * 1.8
+
+
+def test_action_get_error():
+    module = make_module(SlowHandler(fail=True))
+    with pytest.raises(RuntimeError):
+        module.action_get({})
+
+
+def test_action_get_all_registration_thread():
+    threads = {}
+
+    class Handler(SlowHandler):
+        def get_honeypots(self):
+            return {"minipots": {}, "log_credentials": False}
+
+        def get_registered(self, email, language, notify, timeout):
+            threads["get_registered"] = threading.current_thread()
+            time.sleep(DELAY)
+            return {"status": "owned"}
+
+    module = make_module(Handler())
+    start = time.monotonic()
+    res = module.action_get_all({"registration": {"email": "test@test.test", "language": "en"}})
+    elapsed = time.monotonic() - start
+
+    assert res["registration"] == {"status": "owned"}
+    assert res["agreed"] is True
+    # slow registration lookup doesn't occupy the shared pool
+    assert threads["get_registered"] is threading.current_thread()
+    assert elapsed < DELAY * 1.8
+
+
+def test_sending_sampler_on_demand(monkeypatch):
+    class Handler(object):
+        started = 0
+
+        def start_sending_sampler(self):
+            self.started += 1
+
+    monkeypatch.delenv("FORIS_DATA_COLLECT_SAMPLE_SENDING", raising=False)
+    monkeypatch.delenv("FORIS_DATA_COLLECT_PROMETHEUS_PATH", raising=False)
+    handler = Handler()
+    DataCollectModule(lambda msg: None, handler)
+    assert handler.started == 0
+
+    monkeypatch.setenv("FORIS_DATA_COLLECT_SAMPLE_SENDING", "1")
+    DataCollectModule(lambda msg: None, handler)
+    assert handler.started == 1
+
+
+def test_lazy_backend_imports():
+    # what the controller does on startup
+    code = (
+        "import sys, threading\n"
+        "from foris_controller_modules.data_collect import DataCollectModule\n"
+        "from foris_controller_modules.data_collect.handlers import OpenwrtDataCollectHandler\n"
+        "DataCollectModule(lambda msg: None, OpenwrtDataCollectHandler())\n"
+        "print(' '.join(m for m in ['foris_controller_backends.uci', "
+        "'foris_controller_backends.services', 'foris_controller_backends.data_collect.history'] "
+        "if m in sys.modules))\n"
+        "print(' '.join(t.name for t in threading.enumerate() "
+        "if t.name.startswith('data_collect')))\n"
+    )
+    env = {
+        k: v for k, v in os.environ.items()
+        if k not in ("FORIS_DATA_COLLECT_SAMPLE_SENDING", "FORIS_DATA_COLLECT_PROMETHEUS_PATH")
+    }
+    output = subprocess.check_output([sys.executable, "-c", code], env=env).decode()
+    assert output.splitlines() == ["", ""]
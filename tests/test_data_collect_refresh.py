@@ -0,0 +1,90 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Background refresh of the cached registration status (needs its own cache settings) """
+
+import pytest
+import time
+
+from .conftest import (
+    REGISTRATION_CODE, cmdline_script_root, registered_script, registration_code
+)
+from foris_controller_testtools.fixtures import (
+    infrastructure,
+    uci_configs_init,
+    start_buses,
+    mosquitto_test,
+    ubusd_test,
+    only_backends,
+)
+from foris_controller_testtools.utils import FileFaker
+
+REGISTERED = "/usr/share/server-uplink/registered.sh"
+FILTERS = [("data_collect", "registration_changed")]
+
+
+@pytest.fixture(scope="module")
+def env_overrides():
+    return {
+        "FORIS_DATA_COLLECT_REGISTERED_TTL": "1",
+        "FORIS_DATA_COLLECT_REGISTERED_TRANSIENT_TTL": "60",
+        "FORIS_DATA_COLLECT_REGISTERED_STALE_TTL": "3600",
+        "FORIS_DATA_COLLECT_BREAKER_THRESHOLD": "0",
+        "FORIS_DATA_COLLECT_REGISTERED_CACHE_PATH": "",
+    }
+
+
+def get_registered(infrastructure):
+    return infrastructure.process_message(
+        {
+            "module": "data_collect",
+            "action": "get_registered",
+            "kind": "request",
+            "data": {"email": "test@test.test", "language": "en"},
+        }
+    )["data"]
+
+
+@pytest.mark.only_backends(["openwrt"])
+def test_refresh_failure(
+    cmdline_script_root, uci_configs_init, infrastructure, start_buses, registration_code
+):
+    with FileFaker(cmdline_script_root, REGISTERED, True, registered_script("owned")):
+        assert get_registered(infrastructure) == {"status": "owned"}
+
+    time.sleep(1.2)
+
+    # failed refresh keeps the last known status
+    with FileFaker(cmdline_script_root, REGISTERED, True, "#!/bin/sh\nexit 1\n"):
+        assert get_registered(infrastructure) == {"status": "owned", "stale": True}
+        time.sleep(1.0)
+        assert get_registered(infrastructure) == {"status": "owned", "stale": True}
+        time.sleep(1.0)
+
+    # successful refresh is reported (failed ones were not)
+    old_notifications = infrastructure.get_notifications(filters=FILTERS)
+    with FileFaker(cmdline_script_root, REGISTERED, True, registered_script("free")):
+        assert get_registered(infrastructure) == {"status": "owned", "stale": True}
+        notifications = infrastructure.get_notifications(old_notifications, filters=FILTERS)
+
+    new = notifications[len(old_notifications):]
+    assert [e["data"]["status"] for e in new] == ["free"]
+    assert new[0]["data"]["email"] == "test@test.test"
+    assert new[0]["data"]["registration_number"] == REGISTRATION_CODE
+    assert get_registered(infrastructure)["status"] == "free"
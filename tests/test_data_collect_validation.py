@@ -0,0 +1,215 @@
+#
+# foris-controller-data_collect-module
+# Copyright (C) 2020 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import copy
+
+import jsonschema
+import pytest
+
+from foris_controller_modules.data_collect.validation import (
+    DataCollectValidator, base_definitions
+)
+
+
+def _message(kind, action, data=None):
+    res = {"module": "data_collect", "kind": kind, "action": action}
+    if data is not None:
+        res["data"] = data
+    return res
+
+
+SENDING_STATUS = {"state": "online", "last_check": 1500000000.0}
+AVAILABILITY = {"online_percent": 99.5, "transitions": 2, "longest_outage": 120.0}
+CHANNEL = {"1h": AVAILABILITY, "24h": AVAILABILITY, "7d": AVAILABILITY}
+
+VALID = [
+    _message("request", "get_registered", {"email": "test@test.test", "language": "en"}),
+    _message("reply", "get_registered", {"status": "owned"}),
+    _message("reply", "get_registered", {
+        "status": "free", "url": "https://example.com/", "registration_number": "0000000B00009CD6",
+    }),
+    _message("reply", "get_registered", {"status": "unknown", "stale": True}),
+    _message("reply", "get_registered", {"status": "unknown", "reason": "timeout"}),
+    _message("request", "get_registered", {
+        "email": "test@test.test", "language": "en", "timeout": 0.5,
+    }),
+    _message("request", "get"),
+    _message("reply", "get", {
+        "agreed": True, "firewall_status": SENDING_STATUS, "ucollect_status": SENDING_STATUS,
+    }),
+    _message("request", "get_all"),
+    _message("request", "get_all", {
+        "registration": {"email": "test@test.test", "language": "cs"},
+    }),
+    _message("request", "get_sending_history"),
+    _message("request", "get_sending_history", {"from": 0, "to": 1500000000}),
+    _message("reply", "get_sending_history", {
+        "interval": 60, "capacity": 10080, "records": [
+            {"timestamp": 1500000000.0, "firewall": "online", "ucollect": "offline"},
+        ],
+    }),
+    _message("request", "get_sending_stats"),
+    _message("reply", "get_sending_stats", {"firewall": CHANNEL, "ucollect": CHANNEL}),
+    _message("request", "get_metrics"),
+    _message("request", "get_registration_server_status"),
+    _message("reply", "get_registration_server_status", {
+        "state": "closed", "failures": 0, "opened_at": None, "retry_in": None,
+    }),
+    _message("reply", "get_registration_server_status", {
+        "state": "open", "failures": 3, "opened_at": 1500000000.0, "retry_in": 42.5,
+    }),
+    _message("reply", "get_registered", {"status": "unknown", "reason": "circuit_open"}),
+    _message("request", "set", {"agreed": True}),
+    _message("request", "set", {"agreed": False, "async": True}),
+    _message("reply", "set", {"result": True, "applied": False}),
+    _message("reply", "set", {"result": True, "applied": True, "job_id": "abc"}),
+    _message("notification", "set", {"agreed": True}),
+    _message("notification", "set_finished", {"job_id": "abc", "agreed": True, "result": True}),
+    _message("request", "get_honeypots"),
+    _message("reply", "get_honeypots", {
+        "minipots": {"23tcp": True, "2323tcp": False, "80tcp": True, "3128tcp": False,
+                     "8123tcp": True, "8080tcp": False},
+        "log_credentials": True,
+    }),
+    _message("request", "set_honeypots", {
+        "minipots": {"23tcp": True, "2323tcp": False, "80tcp": True, "3128tcp": False,
+                     "8123tcp": True, "8080tcp": False},
+        "log_credentials": False,
+    }),
+    _message("reply", "set_honeypots", {"result": True, "applied": True}),
+    _message("notification", "sending_status_changed", {
+        "firewall_status": SENDING_STATUS, "ucollect_status": SENDING_STATUS,
+    }),
+    _message("notification", "registration_changed", {
+        "email": "test@test.test", "language": "en", "status": "owned",
+    }),
+    _message("notification", "registration_changed", {
+        "email": "test@test.test", "language": "en", "status": "free",
+        "url": "https://example.com/", "registration_number": "0000000B00009CD6",
+    }),
+]
+
+INVALID = [
+    None,
+    [],
+    "get",
+    {},
+    {"module": "data_collect"},
+    {"module": "data_collect", "data": {"agreed": True}},
+    {"module": "data_collect", "kind": "request"},
+    _message(1, "get"),
+    _message("request", None),
+    _message("request", ["get"]),
+    _message("request", "unknown_action"),
+    _message("unknown_kind", "get"),
+    _message("notification", "get"),
+    _message("request", "set"),
+    _message("request", "set", {}),
+    _message("request", "set", {"agreed": "yes"}),
+    _message("request", "set", {"agreed": True, "extra": 1}),
+    _message("reply", "set", {"result": True}),
+    _message("request", "get_registered", {"email": "test@test.test"}),
+    _message("reply", "get_registered", {"status": "owned", "url": "https://example.com/"}),
+    _message("reply", "get_registered", {"status": "nonsense"}),
+    _message("reply", "get_registered", {"status": "owned", "reason": "nonsense"}),
+    _message("request", "get_registered", {
+        "email": "test@test.test", "language": "en", "timeout": 0,
+    }),
+    _message("request", "get_sending_history", {"from": "yesterday"}),
+    _message("reply", "get_registration_server_status", {
+        "state": "broken", "failures": 0, "opened_at": None, "retry_in": None,
+    }),
+    # failed refreshes are not reported
+    _message("notification", "registration_changed", {
+        "email": "test@test.test", "language": "en", "status": "unknown", "reason": "unreachable",
+    }),
+]
+
+
+def _mutations(message):
+    """ Derives (mostly invalid) messages from a valid one """
+    for key in list(message):
+        res = copy.deepcopy(message)
+        del res[key]
+        yield res
+    for key in ["module", "kind", "action", "data"]:
+        for value in [None, 1, "", "data_collect", "request", "reply", "set", {}, []]:
+            res = copy.deepcopy(message)
+            res[key] = value
+            yield res
+    res = copy.deepcopy(message)
+    res["extra"] = True
+    yield res
+    if isinstance(message.get("data"), dict):
+        for key in list(message["data"]):
+            res = copy.deepcopy(message)
+            del res["data"][key]
+            yield res
+        res = copy.deepcopy(message)
+        res["data"]["extra"] = True
+        yield res
+
+
+def _corpus():
+    for message in VALID + INVALID:
+        yield message
+    for message in VALID:
+        for mutation in _mutations(message):
+            yield mutation
+
+
+@pytest.fixture(scope="module")
+def validator():
+    definitions = {"locale_name": {"type": "string", "minLength": 1}}
+    definitions.update(base_definitions())
+    return DataCollectValidator(definitions)
+
+
+@pytest.mark.parametrize("message", VALID)
+def test_valid(validator, message):
+    assert validator.is_valid(message)
+    validator.validate(message)
+
+
+@pytest.mark.parametrize("message", INVALID)
+def test_invalid(validator, message):
+    assert not validator.is_valid(message)
+    with pytest.raises(jsonschema.ValidationError):
+        validator.validate(message)
+
+
+def test_equivalence(validator):
+    count = 0
+    for message in _corpus():
+        assert validator.is_valid(message) == validator.full.is_valid(message), message
+        count += 1
+    assert count > 500
+
+
+def test_dispatch_tries_only_matching_branches(validator):
+    # at most request/reply/notification branch exists for each (kind, action)
+    assert all(len(e) == 1 for e in validator._validators.values())
+    assert ("request", "get") in validator._validators
+    assert ("notification", "get") not in validator._validators
+
+
+def test_missing_definitions():
+    # locale_name comes from foris-controller schemas
+    with pytest.raises(ValueError, match="locale_name"):
+        DataCollectValidator({})